@@ -0,0 +1,79 @@
+"""
+Microbenchmark: top_similar scoring engine against the old table-based one.
+
+    python -m benchmarks.bench_similarity
+    python -m benchmarks.bench_similarity --sizes 10000 100000 --legacy-limit 100000
+"""
+import argparse
+import random
+import string
+import time
+from collections import deque
+from math import ceil
+
+from src.users.utils import top_similar
+
+
+def legacy_ranking(current_row: str, names) -> list[str]:
+    """
+    Scoring and "sorting" exactly as the original similarity_check did before the bit-parallel engine
+    """
+    weights, ranked = dict(), deque()
+    for key in names:
+        row = key.lower().replace(' ', '')
+        table = [[0 for _ in range(len(row) + 1)] for _ in range(len(current_row) + 1)]
+
+        for s in range(1, len(current_row) + 1):
+            for c in range(1, len(row) + 1):
+                if row[c - 1] == current_row[s - 1]:
+                    table[s][c] = table[s - 1][c - 1] + 1
+                else:
+                    table[s][c] = max(table[s - 1][c], table[s][c - 1])
+        weights[key] = table[-1][-1]
+
+    n = len(weights) if len(weights) <= 10 else ceil(len(weights) * 0.25)
+    for i in weights:
+        if ranked and weights[ranked[0]] < weights[i]:
+            ranked.appendleft(i)
+        else:
+            ranked.append(i)
+    return list(ranked)[:n]
+
+
+def random_names(size: int, seed: int = 0) -> list[str]:
+    rnd = random.Random(seed)
+    alphabet = string.ascii_lowercase + string.digits + "_"
+    return [
+        "".join(rnd.choice(alphabet) for _ in range(rnd.randint(5, 20)))
+        for _ in range(size)
+    ]
+
+
+def measure(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--query", default="acme_store")
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--legacy-limit", type=int, default=1_000_000,
+                        help="skip the old engine above this many names")
+    args = parser.parse_args()
+
+    print(f"{'names':>10} {'legacy, s':>10} {'bit-parallel, s':>16} {'speedup':>8}")
+    for size in args.sizes:
+        names = random_names(size)
+        new = measure(top_similar, args.query, names, args.limit)
+        if size <= args.legacy_limit:
+            old = measure(legacy_ranking, args.query, names)
+            print(f"{size:>10} {old:>10.3f} {new:>16.3f} {old / new:>7.1f}x")
+        else:
+            print(f"{size:>10} {'-':>10} {new:>16.3f} {'-':>8}")
+
+
+if __name__ == "__main__":
+    main()
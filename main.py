@@ -1,35 +1,175 @@
-from fastapi import FastAPI
+import asyncio
+import time
+import uuid
+from contextlib import AsyncExitStack, asynccontextmanager, suppress
 
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import SEARCH_BACKEND, COMPLAINT_INGEST, METRICS_DEBUG, HOST, PORT, WORKERS, SHUTDOWN_TIMEOUT, USERNAME_BLOOM, \
+    REDIS_SOCKET_TIMEOUT
 from src.users.auth import auth_backend
 from src.users.schemas import UserCreate, UserRead, UserUpdate
 from src.users.service import user_router
 from src.companies.service import company_router
+from src.companies.database import get_company_body
+from src.database.service import database_router
 from src.database.config import fastapi_users
+from src.database.db_client import async_session_maker, replica_session_maker, StickyPrimaryMiddleware, pool_stats, \
+    warm_pools, close_pools
+from src.database import metrics
+from src.database.cache import cache
+from src.users.database import get_profile
+from src.users.search import search_index
+from src.users.roles import roles
+from src.users.usernames import usernames
+from src.users.password import password_helper
+from src.users.complaints import complaints
 
 '''----------------------------------------CONFIG-------------------------------------------------'''
 
-app = FastAPI()
+async def warm_up() -> None:
+    """
+    Everything the first requests would otherwise pay for: pooled connections, a Redis connection,
+    the roles, the search index and the username filter, and the compiled SQL of the profile and company lookups
+    """
+    await warm_pools()
+    await cache.redis.ping()
+    async with async_session_maker() as session:
+        await roles.load(session)
+        if SEARCH_BACKEND == "index":
+            await search_index.build(session)
+        if USERNAME_BLOOM:
+            await usernames.build(session)
+        await get_profile("", session)
+        with suppress(HTTPException):
+            await get_company_body(uuid.UUID(int=0), session)
+
+
+async def cancel(task: asyncio.Task) -> None:
+    task.cancel()
+    with suppress(asyncio.CancelledError):
+        await task
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # whatever fails during startup or shutdown, everything started so far is stopped, in reverse order
+    async with AsyncExitStack() as stack:
+        stack.push_async_callback(close_pools)
+        password_helper.start()
+        stack.callback(password_helper.shutdown)
+
+        # listening before the roles, the index and the filter are built: what changes during a build is not lost
+        cache.watch("roles", roles.reload)
+        if SEARCH_BACKEND == "index":
+            cache.watch("search", search_index.reload)
+            cache.watch_prefix("search:", search_index.changed)
+        if USERNAME_BLOOM:
+            cache.watch("usernames", usernames.reload)
+            cache.watch_prefix("username:", usernames.announced)
+        stack.push_async_callback(cancel, asyncio.create_task(cache.listen()))
+        await asyncio.wait_for(cache.subscribed.wait(), REDIS_SOCKET_TIMEOUT)
+        await warm_up()
+
+        if COMPLAINT_INGEST != "sync":
+            complaints.start()
+            stack.push_async_callback(complaints.close)
+        yield
+
+
+class InstrumentMiddleware:
+    """
+    ASGI middleware: opens the request's stats, observes them when the response is sent,
+    and adds a Server-Timing header when METRICS_DEBUG is on and the request asks for it
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = metrics.RequestStats(scope)
+        debug = METRICS_DEBUG and "x-debug-timing" in Headers(scope=scope)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_timed(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if debug:
+                    MutableHeaders(scope=message).append(
+                        "Server-Timing", stats.server_timing(time.perf_counter() - started),
+                    )
+            await send(message)
+
+        token = metrics.current.set(stats)
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            metrics.current.reset(token)
+            metrics.observe(scope["method"], stats.route, status, time.perf_counter() - started, stats)
+
+
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(
+        metrics.render(
+            metrics.gauges("db_pool", "Connection pool state", pool_stats(), "pool")
+            + metrics.gauges("cache", "Two-tier cache counters", {"two_tier": cache.stats()}, "cache")
+            + metrics.gauges("password", "Password hashing pool", {"executor": password_helper.stats()}, "pool")
+            + metrics.gauges("username_filter", "Bloom filter of usernames", {"bloom": usernames.stats()}, "filter")
+        ),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan)
+    if replica_session_maker is not None:
+        app.add_middleware(StickyPrimaryMiddleware)
+    app.add_middleware(InstrumentMiddleware)  # added last, so it runs first
+    app.get("/metrics", include_in_schema=False)(get_metrics)
+
+    app.include_router(user_router, prefix="/users", tags=["users"])
+    app.include_router(company_router, prefix="/companies", tags=["companies"])
+    app.include_router(database_router, prefix="/database", tags=["database"])
 
-app.include_router(user_router, prefix="/users", tags=["users"])
-app.include_router(company_router, prefix="/companies", tags=["companies"])
+    app.include_router(
+        fastapi_users.get_auth_router(auth_backend),
+        prefix="/users/jwt",
+        tags=["users"],
+    )
 
+    app.include_router(
+        fastapi_users.get_register_router(UserRead, UserCreate),
+        prefix="/users",
+        tags=["users"],
+    )
 
-app.include_router(
-    fastapi_users.get_auth_router(auth_backend),
-    prefix="/users/jwt",
-    tags=["users"],
-)
+    app.include_router(
+        fastapi_users.get_users_router(UserRead, UserUpdate, requires_verification=True),
+        prefix="/users",
+        tags=["users"],
+    )
+    return app
 
 
-app.include_router(
-    fastapi_users.get_register_router(UserRead, UserCreate),
-    prefix="/users",
-    tags=["users"],
-)
+app = create_app()
 
 
-app.include_router(
-    fastapi_users.get_users_router(UserRead, UserUpdate, requires_verification=True),
-    prefix="/users",
-    tags=["users"],
-)
\ No newline at end of file
+if __name__ == "__main__":
+    # Every worker process builds its own app through the factory and warms up before it accepts connections
+    uvicorn.run(
+        "main:create_app",
+        factory=True,
+        host=HOST,
+        port=PORT,
+        workers=WORKERS,
+        timeout_graceful_shutdown=SHUTDOWN_TIMEOUT,
+    )
@@ -0,0 +1,27 @@
+"""unique user email
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Registration relies on it instead of a separate email lookup; matches get_by_email, which ignores case
+    op.execute('CREATE UNIQUE INDEX IF NOT EXISTS uq_user_email_lower ON "user" (lower(email))')
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS uq_user_email_lower")
@@ -0,0 +1,34 @@
+"""complaint sender, addressee and ingest id
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import UUID
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.alter_column("complaint", "user_id", new_column_name="sender")
+    op.add_column("complaint", sa.Column("addressee", UUID(as_uuid=True), sa.ForeignKey("user.id")))
+    # Redelivered stream entries are inserted with ON CONFLICT DO NOTHING on this key
+    op.add_column("complaint", sa.Column("ingest_id", UUID(as_uuid=True)))
+    op.create_unique_constraint("uq_complaint_ingest_id", "complaint", ["ingest_id"])
+
+
+def downgrade() -> None:
+    op.drop_constraint("uq_complaint_ingest_id", "complaint")
+    op.drop_column("complaint", "ingest_id")
+    op.drop_column("complaint", "addressee")
+    op.alter_column("complaint", "sender", new_column_name="user_id")
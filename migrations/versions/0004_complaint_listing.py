@@ -0,0 +1,42 @@
+"""complaint listing indexes and per-addressee counters
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import UUID
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keyset pages of (addressee, register_at, id) are index range scans
+    op.create_index("ix_complaint_addressee_register_at_id", "complaint", ["addressee", "register_at", "id"])
+
+    op.create_table(
+        "complaint_count",
+        sa.Column("addressee", UUID(as_uuid=True), sa.ForeignKey("user.id"), primary_key=True),
+        sa.Column("count", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("last_at", sa.TIMESTAMP),
+    )
+    op.create_index("ix_complaint_count_count_addressee", "complaint_count", ["count", "addressee"])
+    op.execute(
+        "INSERT INTO complaint_count (addressee, count, last_at) "
+        "SELECT addressee, count(*), max(register_at) FROM complaint WHERE addressee IS NOT NULL GROUP BY addressee"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_complaint_count_count_addressee", table_name="complaint_count")
+    op.drop_table("complaint_count")
+    op.drop_index("ix_complaint_addressee_register_at_id", table_name="complaint")
@@ -2,17 +2,21 @@ import uuid
 from datetime import datetime
 import json
 
+import orjson
 from fastapi import Depends, HTTPException
 from fastapi_users.db import SQLAlchemyUserDatabase
-from sqlalchemy import String, Boolean, TIMESTAMP, func, JSON, select
+from sqlalchemy import String, Boolean, TIMESTAMP, func, JSON
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.dialects.postgresql import UUID
 
+from config import COMPANY_CACHE_TTL, NEGATIVE_CACHE_TTL
 from src.users.models import role, user, company
-from src.database.db_client import Base, get_async_session, redis_client
-from src.users.schemas import UserRead, CompanyRead
-from src.users.utils import similarity_check
+from src.database.db_client import Base, get_async_session, cache_ttl
+from src.database.cache import cache
+from src.users.schemas import UserRead
+from src.companies.schemas import CompanyRead
+from src.users.projections import COMPANY_READ
 
 """----------------------------------------------------TABLES--------------------------------------------------------------------------"""
 
@@ -36,46 +40,24 @@ class Company(Base):
 """----------------------------------------------------FUNCTIONS--------------------------------------------------------------------------"""
 
 
-async def get_company_by_id(company_id: str, session: AsyncSession) -> CompanyRead:
-    redis_key = f"company:{company_id}"
-    cached_company = await redis_client.get(redis_key)
-    if cached_company:
-        company_data = json.loads(cached_company)
-        return CompanyRead(
-            id=company_data["id"],
-            email=company_data["email"],
-            name=company_data["name"],
-            description=company_data["description"],
-            address=company_data["address"],
-            contacts=company_data["contacts"],
-            register_at=company_data["register_at"],
+async def get_company_body(company_id: uuid.UUID, session: AsyncSession) -> bytes:
+    """
+    Serialized CompanyRead, cached as the final response body: a hit skips parsing, validation and serializing
+    """
+    async def load() -> bytes | None:
+        result = await session.execute(
+            COMPANY_READ.select().where(company.c.id == company_id)
         )
+        company_data = result.mappings().first()
+        return orjson.dumps(COMPANY_READ.read(company_data).model_dump()) if company_data else None
 
-    result = await session.execute(
-        select(role).where(role.c.id == company_id)
+    body = await cache.fetch_versioned(
+        f"company:{company_id}", load, cache_ttl(session, COMPANY_CACHE_TTL), raw=True, negative_ttl=NEGATIVE_CACHE_TTL,
     )
-    company_data = result.fetchone()
-    if not company_data:
-        raise HTTPException(status_code=404, detail=f"Role with id {company_id} not found.")
+    if body is None:
+        raise HTTPException(status_code=404, detail=f"Company with id {company_id} not found.")
+    return body
 
-    answer = {
-        "id": company_data[0],
-        "email": company_data[1],
-        "name": company_data[2],
-        "description": company_data[3],
-        "address": company_data[4],
-        "contacts": company_data[5],
-        "register_at": company_data[7],
-    }
 
-    await redis_client.setex(redis_key, 86400, json.dumps(answer))
-
-    return CompanyRead(
-            id = company_data[0],
-            email = company_data[1],
-            name = company_data[2],
-            description = company_data[3],
-            address = company_data[4],
-            contacts = company_data[5],
-            register_at = company_data[7],
-        )
\ No newline at end of file
+async def cache_company(company_read: CompanyRead) -> None:
+    await cache.write_through_raw(f"company:{company_read.id}", orjson.dumps(company_read.model_dump()), COMPANY_CACHE_TTL)
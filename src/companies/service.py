@@ -1,17 +1,31 @@
+import uuid
+
 from sqlalchemy import select, update
 from sqlalchemy.exc import IntegrityError
-from fastapi import Depends, APIRouter, HTTPException
+from fastapi import Depends, APIRouter, HTTPException, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.config import current_user
 from src.companies.models import company
 from src.companies.schemas import CompanyCreate, CompanyUpdate, CompanyRead
-from src.users.database import get_session, User
-from src.companies.database import Company
+from src.database.cache import cache
+from src.users.database import get_session, get_read_only_session, invalidate_profiles, User
+from src.companies.database import Company, cache_company, get_company_body
+from src.users.search import search_index
+from src.users.projections import COMPANY_READ
 
 
 company_router = APIRouter()
 
+
+@company_router.get("/{company_id}", name="get_company")
+async def get_company(
+    company_id: uuid.UUID,
+    session: AsyncSession = Depends(get_read_only_session),
+) -> Response:
+    return Response(await get_company_body(company_id, session), media_type="application/json")
+
+
 @company_router.post("/companies/create", name="create_company")
 async def create_company(
     company_data: CompanyCreate,
@@ -36,8 +50,16 @@ async def create_company(
             await session.rollback()
             raise HTTPException(status_code=400, detail="Company with this email already exists.")
 
+        search_index.add_company(new_company)
+        await search_index.publish("companies", new_company.id)
+        await cache_company(COMPANY_READ.read(COMPANY_READ.from_entity(new_company)))
+
+        session.add(user_db)  # current_user may come detached from the auth cache
         user_db.company_id = new_company.id
         user_db.role_id = 2
+        await session.commit()
+        await cache.invalidate(f"profile:{user_db.username}")
+        await cache.invalidate(f"auth:{user_db.id}")
 
         return new_company
     else:
@@ -68,15 +90,7 @@ async def update_company(
                 address = company_data.address,
                 contacts = company_data.contacts,
             )
-            .returning(
-                company.c.id,
-                company.c.email,
-                company.c.name,
-                company.c.description,
-                company.c.address,
-                company.c.contacts,
-                company.c.register_at,
-            )
+            .returning(*COMPANY_READ.columns)
         )
 
         result = await session.execute(answer)
@@ -88,12 +102,11 @@ async def update_company(
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to create message")
 
-    return CompanyRead(
-        id=company_answer[0],
-        email=company_answer[1],
-        name=company_answer[2],
-        description=company_answer[3],
-        address=company_answer[4],
-        contacts=company_answer[5],
-        register_at=company_answer[6],
-    )
\ No newline at end of file
+    search_index.add("companies", company_answer._mapping)
+    await search_index.publish("companies", company_answer.id)
+
+    company_read = COMPANY_READ.read(company_answer._mapping)
+    await cache_company(company_read)
+    await invalidate_profiles(session, company_read.id)
+
+    return company_read
\ No newline at end of file
@@ -0,0 +1,346 @@
+import asyncio
+import inspect
+import json
+import logging
+import math
+import random
+import time
+import uuid
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Awaitable, Callable
+
+import orjson
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from config import CACHE_LOCAL_SIZE, CACHE_LOCAL_TTL, CACHE_LOCK_MS, CACHE_REFRESH_BETA
+from src.database.db_client import redis_client
+from src.database.metrics import add
+
+logger = logging.getLogger(__name__)
+
+def json_default(value: Any) -> str:
+    return value.isoformat() if isinstance(value, date) else str(value)
+
+
+MISSING = "!missing"  # stands for a row that does not exist; not valid JSON, so never a cached value
+LOCK_POLL_SECONDS = 0.02
+DEFAULT_LOAD_SECONDS = 0.01  # until this worker has timed a load of that kind of key
+
+
+class TwoTierCache:
+    """
+    Per-worker LRU with a TTL in front of Redis.
+    Every write or delete is announced on a pub/sub channel, and the other workers drop their local copy.
+    """
+
+    def __init__(self, redis: Redis, maxsize: int, local_ttl: float, channel: str = "cache:invalidate",
+                 lock_ms: int = CACHE_LOCK_MS, refresh_beta: float = CACHE_REFRESH_BETA):
+        self.redis = redis
+        self.maxsize = maxsize
+        self.local_ttl = local_ttl
+        self.channel = channel
+        self.lock_ms = lock_ms
+        self.refresh_beta = refresh_beta
+        self.origin = uuid.uuid4().hex  # tells our own invalidations apart from the other workers'
+        self.local = OrderedDict()  # key -> (expires_at, value, expires_in_redis_at)
+        self.counters = {"local_hits": 0, "redis_hits": 0, "misses": 0, "invalidations": 0,
+                         "loads": 0, "coalesced": 0, "lock_waits": 0, "early_refreshes": 0, "negative_hits": 0}
+        self.watchers = dict()  # key -> coroutine function run when another worker publishes the key
+        self.prefix_watchers = dict()  # prefix -> function called with every key published under it, may be async
+        self.tasks = set()
+        self.subscribed = asyncio.Event()  # set while listen() is subscribed to the channel
+        self.flights = dict()  # key -> future of the load in progress in this worker
+        self.load_seconds = dict()  # key prefix ("company", "profile", ...) -> moving average of a load
+
+    def count(self, counter: str) -> None:
+        self.counters[counter] += 1
+        add("cache_misses" if counter == "misses" else "cache_hits")
+
+    def get_local_entry(self, key: str) -> tuple | None:
+        entry = self.local.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.local[key]
+            return None
+        self.local.move_to_end(key)
+        return entry
+
+    def get_local(self, key: str) -> Any | None:
+        entry = self.get_local_entry(key)
+        return entry[1] if entry is not None else None
+
+    def set_local(self, key: str, value: Any, ttl: float, redis_ttl: float | None = None) -> None:
+        """
+        `redis_ttl`: how long the Redis copy lives, when known; fetch() refreshes early against it
+        """
+        if self.maxsize <= 0:
+            return
+        now = time.monotonic()
+        self.local[key] = (now + min(ttl, self.local_ttl), value, now + redis_ttl if redis_ttl is not None else None)
+        self.local.move_to_end(key)
+        while len(self.local) > self.maxsize:
+            self.local.popitem(last=False)
+
+    async def set(self, key: str, value: Any, ttl: int) -> None:
+        body = json.dumps(value, default=json_default)
+        await self.redis.setex(key, ttl, body)
+        self.set_local(key, json.loads(body), ttl, ttl)  # the local copy must look like a Redis one
+        await self.publish(key)
+
+    async def set_raw(self, key: str, body: bytes, ttl: int) -> None:
+        await self.redis.setex(key, ttl, body)
+        self.set_local(key, body, ttl, ttl)
+        await self.publish(key)
+
+    async def version(self, key: str) -> int:
+        version_key = f"{key}:version"
+        version = self.get_local(version_key)
+        if version is None:
+            version = int(await self.redis.get(version_key) or 0)
+            self.set_local(version_key, version, self.local_ttl)
+        return version
+
+    @staticmethod
+    def decode(value: Any, raw: bool) -> Any:
+        """
+        The local tier holds bytes or parsed JSON, depending on which method stored the key
+        """
+        if value is None:
+            return None
+        if raw:
+            return value if isinstance(value, bytes) else orjson.dumps(value)
+        return orjson.loads(value) if isinstance(value, bytes) else value
+
+    async def fetch(self, key: str, load: Callable[[], Awaitable[Any]], ttl: int, raw: bool = False,
+                    negative_ttl: int = 0) -> Any | None:
+        """
+        Cached value of `key`, or the stored JSON as bytes with `raw`, for a response that sends it unchanged.
+        A missing value is loaded and stored here, so concurrent misses do not all hit Postgres: in this worker the callers share one load, across workers a short Redis lock lets one of them load while
+        the others wait for its result. Shortly before the Redis copy expires a request may reload it early,
+        the likelier the closer the expiry (XFetch), so a popular key is refreshed before it is missed.
+        `load` returning None (nothing to cache) or raising is passed on to every waiting caller.
+        With `negative_ttl` a None is cached too, for that long, so lookups of a missing row stop reaching Postgres
+        """
+        entry = self.get_local_entry(key)
+        if entry is not None:
+            self.count("local_hits")
+            value = self.found(entry[1], raw)
+            return await self.refresh(key, load, ttl, raw, value, negative_ttl) if self.expiring(key, entry[2]) else value
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            cached, pttl = await pipe.get(key).pttl(key).execute()
+        if cached is None:
+            self.count("misses")
+            return await self.single_flight(key, load, ttl, raw, negative_ttl=negative_ttl)
+
+        self.count("redis_hits")
+        value = cached if cached == MISSING else cached.encode() if raw else json.loads(cached)
+        redis_ttl = pttl / 1000 if pttl > 0 else None
+        self.set_local(key, value, redis_ttl or self.local_ttl, redis_ttl)
+        expires_at = time.monotonic() + redis_ttl if redis_ttl is not None else None
+        value = self.found(value, raw)
+        return await self.refresh(key, load, ttl, raw, value, negative_ttl) if self.expiring(key, expires_at) else value
+
+    def found(self, value: Any, raw: bool) -> Any | None:
+        if isinstance(value, str) and value == MISSING:
+            self.counters["negative_hits"] += 1
+            return None
+        return self.decode(value, raw)
+
+    async def fetch_versioned(self, key: str, load: Callable[[], Awaitable[Any]], ttl: int, raw: bool = False,
+                              negative_ttl: int = 0) -> Any | None:
+        """
+        fetch() under the current version of `key`; a load that races a writer lands under the old version,
+        and invalidate(key) also drops a cached "missing"
+        """
+        version = await self.version(key)
+        return await self.fetch(f"{key}:v{version}", load, ttl, raw, negative_ttl)
+
+    def expiring(self, key: str, expires_at: float | None) -> bool:
+        if expires_at is None or self.refresh_beta <= 0:
+            return False
+        load_seconds = self.load_seconds.get(key.split(":", 1)[0], DEFAULT_LOAD_SECONDS)
+        return time.monotonic() - load_seconds * self.refresh_beta * math.log(1 - random.random()) >= expires_at
+
+    async def refresh(self, key: str, load, ttl: int, raw: bool, current: Any, negative_ttl: int) -> Any:
+        """
+        Early reload of a value that is still valid; whoever finds a reload already running keeps `current`
+        """
+        self.counters["early_refreshes"] += 1
+        return await self.single_flight(key, load, ttl, raw, current, negative_ttl)
+
+    async def single_flight(self, key: str, load, ttl: int, raw: bool, current: Any = None,
+                            negative_ttl: int = 0) -> Any | None:
+        while (flight := self.flights.get(key)) is not None:
+            self.counters["coalesced"] += 1
+            if current is not None:
+                return current
+            try:
+                return self.decode(await asyncio.shield(flight), raw)  # the leader may have wanted the other form
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise  # this caller was cancelled, not the one loading
+
+        flight = self.flights[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await self.load_locked(key, load, ttl, raw, current, negative_ttl)
+        except asyncio.CancelledError:
+            flight.cancel()  # the waiters load again themselves
+            raise
+        except BaseException as e:
+            flight.set_exception(e)
+            flight.exception()  # retrieved, even if nobody was waiting
+            raise
+        else:
+            flight.set_result(value)
+            return value
+        finally:
+            del self.flights[key]
+
+    async def load_locked(self, key: str, load, ttl: int, raw: bool, current: Any, negative_ttl: int) -> Any | None:
+        lock_key, token = f"{key}:lock", uuid.uuid4().hex
+        locked = await self.redis.set(lock_key, token, nx=True, px=self.lock_ms)
+        if not locked:
+            if current is not None:
+                return current  # another worker is refreshing it
+            self.counters["lock_waits"] += 1
+            deadline = time.monotonic() + self.lock_ms / 1000
+            while time.monotonic() < deadline:
+                await asyncio.sleep(LOCK_POLL_SECONDS)
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    cached, held = await pipe.get(key).exists(lock_key).execute()
+                if cached is not None:
+                    value = cached if cached == MISSING else cached.encode() if raw else json.loads(cached)
+                    self.set_local(key, value, self.local_ttl)
+                    return self.found(value, raw)
+                if not held:
+                    break  # released without a value: the holder's load failed or found nothing to cache
+            # the lock holder failed or is too slow: load without the lock
+
+        try:
+            started = time.perf_counter()
+            value = await load()
+            self.timed_load(key, time.perf_counter() - started)
+            if value is not None:
+                await (self.set_raw(key, value, ttl) if raw else self.set(key, value, ttl))
+            elif negative_ttl > 0:
+                await self.redis.setex(key, negative_ttl, MISSING)
+                self.set_local(key, MISSING, negative_ttl, negative_ttl)
+                await self.publish(key)
+            return value
+        finally:
+            if locked and await self.redis.get(lock_key) == token:
+                await self.redis.delete(lock_key)
+
+    def timed_load(self, key: str, seconds: float) -> None:
+        self.counters["loads"] += 1
+        prefix = key.split(":", 1)[0]
+        previous = self.load_seconds.get(prefix)
+        self.load_seconds[prefix] = seconds if previous is None else 0.9 * previous + 0.1 * seconds
+
+    async def invalidate(self, key: str) -> int:
+        """
+        Called right after the commit that changed what `key` holds: moves it to a new, empty version
+        """
+        return (await self.invalidate_many([key]))[0]
+
+    async def invalidate_many(self, keys: list[str]) -> list[int]:
+        """
+        invalidate() for a batch of keys, in two round trips whatever their number
+        """
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.incr(f"{key}:version")
+            versions = await pipe.execute()
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, version in zip(keys, versions):
+                self.set_local(f"{key}:version", version, self.local_ttl)
+                pipe.publish(self.channel, f"{self.origin} {key}:version")
+                pipe.delete(f"{key}:v{version - 1}")
+            await pipe.execute()
+        return versions
+
+    async def write_through_raw(self, key: str, body: bytes, ttl: int) -> None:
+        version = await self.invalidate(key)
+        await self.set_raw(f"{key}:v{version}", body, ttl)
+
+    async def publish(self, key: str) -> None:
+        await self.redis.publish(self.channel, f"{self.origin} {key}")
+
+    def watch(self, key: str, callback) -> None:
+        self.watchers[key] = callback
+
+    def watch_prefix(self, prefix: str, callback) -> None:
+        self.prefix_watchers[prefix] = callback
+
+    def spawn(self, coroutine) -> None:
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        task.add_done_callback(self.watcher_done)
+
+    @staticmethod
+    def watcher_done(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("cache watcher failed", exc_info=task.exception())
+
+    def run_watcher(self, key: str) -> None:
+        self.spawn(self.watchers[key]())
+
+    def received(self, data: str) -> None:
+        origin, key = data.split(" ", 1)
+        if origin == self.origin:
+            return
+        self.local.pop(key, None)
+        self.counters["invalidations"] += 1
+        if key in self.watchers:
+            self.run_watcher(key)
+        for prefix, callback in self.prefix_watchers.items():
+            if key.startswith(prefix):
+                try:
+                    result = callback(key[len(prefix):])
+                except Exception:  # one watcher's failure must not keep the message from the others
+                    logger.exception("cache watcher for %r failed on %r", prefix, key)
+                    continue
+                if inspect.isawaitable(result):
+                    self.spawn(result)
+
+    async def listen(self) -> None:
+        """
+        Drops local entries that other workers changed. Runs for the app's lifetime;
+        after a lost connection the whole local tier is cleared and every watcher runs once resubscribed,
+        since messages may have been missed
+        """
+        missed = False
+        self.subscribed.clear()
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    self.subscribed.set()
+                    if missed:
+                        for key in self.watchers:
+                            self.run_watcher(key)
+                        missed = False
+                    async for message in pubsub.listen():
+                        if message["type"] != "message":
+                            continue
+                        try:
+                            self.received(message["data"])
+                        except Exception:
+                            logger.exception("bad cache invalidation %r", message["data"])
+            except RedisError:
+                self.subscribed.clear()
+                self.local.clear()
+                missed = True
+                await asyncio.sleep(1)
+
+    def stats(self) -> dict[str, int]:
+        return {**self.counters, "local_size": len(self.local), "in_flight": len(self.flights)}
+
+
+cache = TwoTierCache(redis_client, CACHE_LOCAL_SIZE, CACHE_LOCAL_TTL)
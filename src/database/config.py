@@ -1,9 +1,11 @@
 import uuid
+from fastapi import Depends, HTTPException
 from fastapi_users import FastAPIUsers
 
 from src.users.auth import auth_backend
 from src.users.manager import get_user_manager
 from src.users.database import User
+from src.users.roles import roles
 
 
 fastapi_users = FastAPIUsers[User, uuid.UUID](
@@ -11,4 +13,17 @@ fastapi_users = FastAPIUsers[User, uuid.UUID](
     [auth_backend],
 )
 
-current_user = fastapi_users.current_user()
\ No newline at end of file
+current_user = fastapi_users.current_user()
+current_superuser = fastapi_users.current_user(active=True, superuser=True)
+
+
+def require_permission(*permissions: str):
+    """
+    Dependency that lets the request through only when the user's role grants all `permissions` (or a superuser)
+    """
+    async def dependency(user: User = Depends(current_user)) -> User:
+        if not user.is_superuser and not roles.allows(user.role_id, *permissions):
+            raise HTTPException(status_code=403, detail="Not enough permissions")
+        return user
+
+    return dependency
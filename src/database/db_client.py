@@ -1,20 +1,237 @@
+import asyncio
+import time
+from math import ceil
 from typing import AsyncGenerator
 
-from redis.asyncio import Redis
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from fastapi import Request
+from redis.asyncio import Redis, BlockingConnectionPool
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from config import DB_PORT, DB_NAME, DB_USER, DB_PASS, DB_HOST
+from config import DB_PORT, DB_NAME, DB_USER, DB_PASS, DB_HOST, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, \
+    DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_STATEMENT_CACHE, REDIS_HOST, REDIS_PORT, REDIS_MAX_CONNECTIONS, \
+    REDIS_POOL_TIMEOUT, REDIS_SOCKET_TIMEOUT, DB_REPLICA_URL, REPLICA_STICKY_SECONDS, REPLICA_CACHE_TTL, DB_POOL_WARM
+from src.database.metrics import add, instrument_engine
+from src.database.slow_queries import slow_queries
+
+
+class WaitStats:
+    """
+    How many times a connection was checked out of a pool and how long callers waited for it
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.checkouts += 1
+        self.wait_seconds += seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def as_dict(self) -> dict[str, float]:
+        return {
+            "checkouts": self.checkouts,
+            "wait_seconds": self.wait_seconds,
+            "max_wait_seconds": self.max_wait_seconds,
+        }
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    wait_stats = WaitStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.wait_stats.record(time.perf_counter() - started)
+
+
+class InstrumentedRedis(Redis):
+    """
+    Counts and times every command in the stats of the request that sent it
+    """
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            add("redis")
+            add("redis_seconds", time.perf_counter() - started)
+
+
+class TimedRedisPool(BlockingConnectionPool):
+    wait_stats = WaitStats()
+
+    async def get_connection(self, command_name, *keys, **options):
+        started = time.perf_counter()
+        try:
+            return await super().get_connection(command_name, *keys, **options)
+        finally:
+            self.wait_stats.record(time.perf_counter() - started)
 
 
 DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 Base: DeclarativeBase = declarative_base()
-redis_client = Redis(host='localhost', port=6379, decode_responses=True)
 
-engine = create_async_engine(DATABASE_URL)
+redis_pool = TimedRedisPool(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    timeout=REDIS_POOL_TIMEOUT,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+    decode_responses=True,
+)
+redis_client = InstrumentedRedis(connection_pool=redis_pool)
+
+
+def make_engine(url: str, poolclass=TimedQueuePool) -> AsyncEngine:
+    if not url.startswith("postgresql"):  # a SQLite file standing in for a replica in tests
+        return create_async_engine(url)
+    return create_async_engine(
+        url,
+        poolclass=poolclass,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        # PgBouncer in transaction mode cannot keep prepared statements between transactions
+        connect_args={} if DB_STATEMENT_CACHE else {"statement_cache_size": 0, "prepared_statement_cache_size": 0},
+    )
+
+
+engine = make_engine(DATABASE_URL)
+instrument_engine(engine)
+slow_queries.watch(engine)
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
+replica_engine = make_engine(DB_REPLICA_URL, AsyncAdaptedQueuePool) if DB_REPLICA_URL else None
+if replica_engine is not None:
+    instrument_engine(replica_engine)
+    slow_queries.watch(replica_engine)
+replica_session_maker = (
+    async_sessionmaker(replica_engine, expire_on_commit=False, info={"replica": True})
+    if replica_engine is not None else None
+)
+
+READ_METHODS = ("GET", "HEAD")
+STICKY_COOKIE = "primary_until"
+
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_maker() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+
+def read_session_maker(request: Request) -> async_sessionmaker:
+    """
+    Reads go to the replica, except for a client that wrote within the last REPLICA_STICKY_SECONDS:
+    it keeps reading from the primary, so it sees its own writes despite replication lag
+    """
+    if replica_session_maker is None or request.method not in READ_METHODS:
+        return async_session_maker
+    try:
+        if float(request.cookies.get(STICKY_COOKIE, 0)) > time.time():
+            return async_session_maker
+    except ValueError:
+        pass
+    return replica_session_maker
+
+
+async def get_read_session(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    async with read_session_maker(request)() as session:
+        yield session
+
+
+class StickyPrimaryMiddleware:
+    """
+    ASGI middleware, added only with a replica: a successful write pins the client to the primary
+    for REPLICA_STICKY_SECONDS
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] in READ_METHODS:
+            return await self.app(scope, receive, send)
+
+        async def send_sticky(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "set-cookie",
+                    f"{STICKY_COOKIE}={time.time() + REPLICA_STICKY_SECONDS}; HttpOnly; "
+                    f"Max-Age={ceil(REPLICA_STICKY_SECONDS)}; Path=/; SameSite=lax",
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_sticky)
+
+
+def cache_ttl(session: AsyncSession, ttl: int) -> int:
+    """
+    A row read from the replica may already be outdated, so it is cached only briefly
+    """
+    return min(ttl, REPLICA_CACHE_TTL) if session.info.get("replica") else ttl
+
+
+async def warm_pools(connections: int = DB_POOL_WARM) -> None:
+    """
+    Opens `connections` connections on the primary and replica pools at once and returns them to the pool,
+    so the first requests after a start do not wait for TCP, TLS and authentication
+    """
+    for pooled in (engine, replica_engine):
+        if pooled is None or not isinstance(pooled.pool, AsyncAdaptedQueuePool):
+            continue
+        opened = await asyncio.gather(
+            *(pooled.connect().start() for _ in range(min(connections, pooled.pool.size()))),
+            return_exceptions=True,
+        )
+        for connection in opened:
+            if not isinstance(connection, BaseException):
+                await connection.close()
+        for connection in opened:
+            if isinstance(connection, BaseException):
+                raise connection
+
+
+async def close_pools() -> None:
+    await engine.dispose()
+    if replica_engine is not None:
+        await replica_engine.dispose()
+    await redis_pool.disconnect()
+
+
+def pool_stats() -> dict[str, dict]:
+    pool = engine.pool
+    return {
+        "postgres": {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "max_overflow": DB_MAX_OVERFLOW,
+            **TimedQueuePool.wait_stats.as_dict(),
+        } if isinstance(pool, AsyncAdaptedQueuePool) else TimedQueuePool.wait_stats.as_dict(),
+        "redis": {
+            "max_connections": redis_pool.max_connections,
+            "in_use": len(redis_pool._in_use_connections),
+            "available": len(redis_pool._available_connections),
+            **TimedRedisPool.wait_stats.as_dict(),
+        },
+        **({"replica": {
+            "size": replica_engine.pool.size(),
+            "checked_in": replica_engine.pool.checkedin(),
+            "checked_out": replica_engine.pool.checkedout(),
+            "overflow": replica_engine.pool.overflow(),
+        }} if isinstance(getattr(replica_engine, "pool", None), AsyncAdaptedQueuePool) else {}),
+    }
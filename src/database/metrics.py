@@ -0,0 +1,174 @@
+"""
+Per-request instrumentation and its Prometheus text exposition.
+
+The middleware opens a RequestStats for every request in a ContextVar; SQL statements (engine events),
+Redis commands, cache lookups, search ranking and password hashing add to whichever request they run in.
+When the request ends its numbers go into per-route histograms. Metrics are per worker process:
+with several workers every one of them has to be scraped.
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+class RequestStats:
+    __slots__ = ("scope", "sql", "sql_seconds", "redis", "redis_seconds", "cache_hits", "cache_misses",
+                 "similarity_seconds", "hash_seconds")
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.sql = self.redis = self.cache_hits = self.cache_misses = 0
+        self.sql_seconds = self.redis_seconds = self.similarity_seconds = self.hash_seconds = 0.0
+
+    @property
+    def route(self) -> str:
+        """
+        The matched route template, e.g. /users/profile/{username}; the router adds it to the scope
+        """
+        route = self.scope.get("route")
+        return route.path if route is not None else "unmatched"
+
+    def server_timing(self, seconds: float) -> str:
+        """
+        Server-Timing header value, shown per request by browser dev tools
+        """
+        return ", ".join([
+            f"total;dur={seconds * 1000:.2f}",
+            f'sql;dur={self.sql_seconds * 1000:.2f};desc="{self.sql} statements"',
+            f'redis;dur={self.redis_seconds * 1000:.2f};desc="{self.redis} calls"',
+            f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"',
+            f"similarity;dur={self.similarity_seconds * 1000:.2f}",
+            f"hash;dur={self.hash_seconds * 1000:.2f}",
+        ])
+
+
+current: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+def add(name: str, value: float = 1) -> None:
+    """
+    Adds to the current request's stats; a no-op outside of a request (startup, background tasks)
+    """
+    stats = current.get()
+    if stats is not None:
+        setattr(stats, name, getattr(stats, name) + value)
+
+
+@contextmanager
+def timed(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name, time.perf_counter() - started)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...], buckets: tuple[float, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = dict()  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, values: tuple, amount: float) -> None:
+        series = self.series.get(values)
+        if series is None:
+            series = self.series[values] = [0] * len(self.buckets) + [0.0, 0]
+        index = bisect_left(self.buckets, amount)  # first bucket with amount <= le
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += amount
+        series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, series in self.series.items():
+            labels = ",".join(f'{name}="{value}"' for name, value in zip(self.labels, values))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-2]}")
+            lines.append(f"{self.name}_count{{{labels}}} {series[-1]}")
+        return lines
+
+
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CALLS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+ROUTE = ("method", "route")
+
+request_seconds = Histogram("http_request_duration_seconds", "Request latency", ROUTE + ("status",), SECONDS)
+sql_statements = Histogram("http_request_sql_statements", "SQL statements per request", ROUTE, CALLS)
+sql_seconds = Histogram("http_request_sql_seconds", "Time in SQL statements per request", ROUTE, SECONDS)
+redis_calls = Histogram("http_request_redis_calls", "Redis commands per request", ROUTE, CALLS)
+redis_seconds = Histogram("http_request_redis_seconds", "Time in Redis commands per request", ROUTE, SECONDS)
+cache_hits = Histogram("http_request_cache_hits", "Cache hits per request", ROUTE, CALLS)
+cache_misses = Histogram("http_request_cache_misses", "Cache misses per request", ROUTE, CALLS)
+similarity_seconds = Histogram("http_request_similarity_seconds", "Time ranking search results per request",
+                               ROUTE, SECONDS)
+hash_seconds = Histogram("http_request_password_hash_seconds", "Time hashing or verifying passwords per request",
+                         ROUTE, SECONDS)
+
+HISTOGRAMS = (request_seconds, sql_statements, sql_seconds, redis_calls, redis_seconds, cache_hits, cache_misses,
+              similarity_seconds, hash_seconds)
+
+
+def observe(method: str, route: str, status: int, seconds: float, stats: RequestStats) -> None:
+    labels = (method, route)
+    request_seconds.observe(labels + (status,), seconds)
+    sql_statements.observe(labels, stats.sql)
+    sql_seconds.observe(labels, stats.sql_seconds)
+    redis_calls.observe(labels, stats.redis)
+    redis_seconds.observe(labels, stats.redis_seconds)
+    cache_hits.observe(labels, stats.cache_hits)
+    cache_misses.observe(labels, stats.cache_misses)
+    similarity_seconds.observe(labels, stats.similarity_seconds)
+    hash_seconds.observe(labels, stats.hash_seconds)
+
+
+def gauges(name: str, help: str, values: dict[str, dict[str, float]], label: str) -> list[str]:
+    """
+    One gauge family per key of the inner dicts, e.g. pool_stats() -> db_pool_checked_out{pool="postgres"}
+    """
+    families = dict()
+    for owner, stats in values.items():
+        for key, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                families.setdefault(key, []).append(f'{name}_{key}{{{label}="{owner}"}} {value}')
+    lines = []
+    for key, samples in families.items():
+        lines += [f"# HELP {name}_{key} {help}", f"# TYPE {name}_{key} gauge", *samples]
+    return lines
+
+
+def render(extra: list[str] = ()) -> str:
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.render()
+    lines += extra
+    return "\n".join(lines) + "\n"
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """
+    Counts and times every statement the engine sends; the start time rides on the connection's info dict
+    """
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        add("sql")
+        add("sql_seconds", time.perf_counter() - conn.info["query_started"].pop())
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None and context.connection.info.get("query_started"):
+            context.connection.info["query_started"].pop()
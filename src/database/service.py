@@ -0,0 +1,31 @@
+from typing import Any
+
+from fastapi import APIRouter, Depends
+
+from src.database.config import current_superuser
+from src.database.db_client import pool_stats
+from src.database.slow_queries import slow_queries
+from src.users.database import User
+
+
+database_router = APIRouter()
+
+
+@database_router.get("/pools", name="pool_stats")
+async def get_pool_stats(superuser: User = Depends(current_superuser)) -> dict[str, Any]:
+    return pool_stats()
+
+
+@database_router.get("/slow-queries", name="slow_queries")
+async def get_slow_queries(superuser: User = Depends(current_superuser)) -> dict[str, Any]:
+    return {
+        **slow_queries.stats(),
+        "statements": slow_queries.statements(),
+        "queries": list(reversed(slow_queries.entries)),  # newest first
+    }
+
+
+@database_router.delete("/slow-queries", name="clear_slow_queries")
+async def clear_slow_queries(superuser: User = Depends(current_superuser)) -> dict[str, Any]:
+    slow_queries.clear()
+    return slow_queries.stats()
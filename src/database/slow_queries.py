@@ -0,0 +1,161 @@
+"""
+Slow-query log. Every statement slower than SLOW_QUERY_MS is logged with its normalized SQL, the shapes
+of its bound parameters and the route that sent it, and kept in a ring buffer of SLOW_QUERY_LOG_SIZE entries.
+A sampled share of the slow SELECTs is run once more under EXPLAIN (ANALYZE, BUFFERS) on a separate
+connection and the plan is attached to the entry. The buffer is per worker, like the metrics.
+"""
+import asyncio
+import logging
+import random
+import re
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any
+
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from config import SLOW_QUERY_MS, SLOW_QUERY_EXPLAIN_RATE, SLOW_QUERY_LOG_SIZE
+from src.database.metrics import current
+
+logger = logging.getLogger(__name__)
+
+# ANALYZE executes the statement, which is why only SELECTs are explained
+EXPLAIN = {
+    "postgresql": "EXPLAIN (ANALYZE, BUFFERS) ",
+    "sqlite": "EXPLAIN QUERY PLAN ",  # the SQLite stand-in of the benchmark has no ANALYZE
+}
+
+PLACEHOLDER = r"(?:\$\d+|\?|%s|%\(\w+\)s|:\w+)"
+PLACEHOLDER_LIST = re.compile(rf"\(\s*{PLACEHOLDER}(?:\s*,\s*{PLACEHOLDER})+\s*\)")
+REPEATED_ROWS = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r"(?<![\w$.])\d+(?:\.\d+)?\b")
+SPACE = re.compile(r"\s+")
+
+
+def normalize(statement: str) -> str:
+    """
+    One text per query shape: literals become ?, IN lists and VALUES rows of any length collapse to (...)
+    """
+    statement = SPACE.sub(" ", statement).strip()
+    statement = NUMBER.sub("?", STRING.sub("?", statement))
+    statement = PLACEHOLDER_LIST.sub("(...)", statement)
+    return REPEATED_ROWS.sub("(...), ...", statement)
+
+
+def shape(value: Any) -> str:
+    if isinstance(value, (str, bytes, list, tuple, dict)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def parameter_shapes(parameters, executemany: bool) -> list[str] | dict[str, str] | str:
+    """
+    Types (and lengths) of the bound parameters, never their values
+    """
+    if executemany:
+        rows = list(parameters)
+        return f"{len(rows)} rows of {parameter_shapes(rows[0], False)}" if rows else "0 rows"
+    if isinstance(parameters, dict):
+        return {name: shape(value) for name, value in parameters.items()}
+    return [shape(value) for value in parameters or ()]
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms: float, explain_rate: float, size: int):
+        self.threshold = threshold_ms / 1000
+        self.explain_rate = explain_rate
+        self.entries = deque(maxlen=size)
+        self.task = None  # at most one EXPLAIN ANALYZE at a time, it repeats a query that is already slow
+        self.counters = {"slow": 0, "explained": 0, "explain_failed": 0}
+
+    def watch(self, engine: AsyncEngine) -> None:
+        @event.listens_for(engine.sync_engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("slow_query_started", []).append(time.perf_counter())
+
+        @event.listens_for(engine.sync_engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            seconds = time.perf_counter() - conn.info["slow_query_started"].pop()
+            if seconds >= self.threshold and not context.execution_options.get("explain"):
+                self.record(engine, statement, parameters, executemany, seconds)
+
+        @event.listens_for(engine.sync_engine, "handle_error")
+        def handle_error(context):
+            if context.connection is not None and context.connection.info.get("slow_query_started"):
+                context.connection.info["slow_query_started"].pop()
+
+    def record(self, engine: AsyncEngine, statement: str, parameters, executemany: bool, seconds: float) -> None:
+        stats = current.get()
+        entry = {
+            "at": datetime.now().isoformat(timespec="milliseconds"),
+            "ms": round(seconds * 1000, 2),
+            "route": f"{stats.scope['method']} {stats.route}" if stats is not None else None,
+            "sql": normalize(statement),
+            "parameters": parameter_shapes(parameters, executemany),
+            "plan": None,
+        }
+        self.entries.append(entry)
+        self.counters["slow"] += 1
+        logger.warning(
+            "slow query %.1f ms on %s: %s parameters=%s", entry["ms"], entry["route"], entry["sql"], entry["parameters"],
+        )
+
+        if (
+            not executemany
+            and engine.dialect.name in EXPLAIN
+            and statement.lstrip()[:6].upper() == "SELECT"
+            and self.task is None
+            and random.random() < self.explain_rate
+        ):
+            self.task = asyncio.get_running_loop().create_task(self.explain(engine, entry, statement, parameters))
+            self.task.add_done_callback(self.explained)
+
+    async def explain(self, engine: AsyncEngine, entry: dict, statement: str, parameters) -> None:
+        try:
+            async with engine.connect() as connection:
+                result = await connection.exec_driver_sql(
+                    EXPLAIN[engine.dialect.name] + statement, parameters, execution_options={"explain": True},
+                )
+                entry["plan"] = "\n".join(str(row[-1]) for row in result)
+            self.counters["explained"] += 1
+        except (SQLAlchemyError, OSError) as e:
+            entry["plan"] = f"EXPLAIN failed: {e}"
+            self.counters["explain_failed"] += 1
+
+    def explained(self, task: asyncio.Task) -> None:
+        self.task = None
+
+    def statements(self) -> list[dict]:
+        """
+        The buffered slow queries grouped by normalized SQL, the most total time first
+        """
+        grouped = dict()
+        for entry in self.entries:
+            group = grouped.setdefault(entry["sql"], {"sql": entry["sql"], "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                                      "routes": set()})
+            group["count"] += 1
+            group["total_ms"] += entry["ms"]
+            group["max_ms"] = max(group["max_ms"], entry["ms"])
+            group["routes"].add(entry["route"])
+        for group in grouped.values():
+            group["total_ms"] = round(group["total_ms"], 2)
+            group["routes"] = sorted(route for route in group["routes"] if route is not None)
+        return sorted(grouped.values(), key=lambda group: group["total_ms"], reverse=True)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            **self.counters,
+            "threshold_ms": self.threshold * 1000,
+            "explain_rate": self.explain_rate,
+            "buffered": len(self.entries),
+        }
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+slow_queries = SlowQueryLog(SLOW_QUERY_MS, SLOW_QUERY_EXPLAIN_RATE, SLOW_QUERY_LOG_SIZE)
@@ -0,0 +1,246 @@
+"""
+Bulk import of users and companies from CSV or NDJSON.
+
+    python -m src.users.bulk_import users sellers.csv
+    python -m src.users.bulk_import companies companies.ndjson --batch-size 5000
+"""
+import argparse
+import asyncio
+import csv
+import json
+import time
+import uuid
+from datetime import datetime
+from typing import Iterable, Iterator
+
+from pydantic import ValidationError
+from sqlalchemy import select, insert, or_, func, Table, JSON
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import IMPORT_BATCH_SIZE
+from src.database.cache import cache
+from src.database.db_client import async_session_maker
+from src.users.models import user, company
+from src.users.schemas import UserCreate
+from src.companies.schemas import CompanyCreate
+from src.users.password import password_helper
+from src.users.search import search_index
+from src.users.usernames import usernames
+from src.users.projections import USER_READ, COMPANY_READ
+
+
+def read_rows(stream: Iterable[str], fmt: str) -> Iterator[tuple[int, dict | None]]:
+    """
+    (line number, row) pairs; a row that cannot be parsed comes as None
+    """
+    if fmt == "csv":
+        for n, row in enumerate(csv.DictReader(stream), start=2):
+            if isinstance(row.get("contacts"), str):
+                try:
+                    row["contacts"] = json.loads(row["contacts"])
+                except ValueError:
+                    pass  # left to the schema to reject
+            yield n, row
+        return
+
+    for n, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield n, row if isinstance(row, dict) else None
+
+
+def detect_format(filename: str) -> str:
+    return "csv" if filename.lower().endswith(".csv") else "ndjson"
+
+
+class Importer:
+    """
+    Validates rows with the API schemas, drops duplicates, and loads whole batches with COPY
+    """
+
+    def __init__(self, kind: str, session: AsyncSession, batch_size: int = IMPORT_BATCH_SIZE):
+        self.kind = kind
+        self.session = session
+        self.batch_size = batch_size
+        self.table: Table = user if kind == "users" else company
+        self.schema = UserCreate if kind == "users" else CompanyCreate
+        self.projection = USER_READ if kind == "users" else COMPANY_READ
+        self.unique = ("username", "email") if kind == "users" else ("name", "email")
+        self.seen = {field: set() for field in self.unique}
+        self.imported = 0
+        self.errors = []
+
+    def reject(self, n: int, errors) -> None:
+        self.errors.append({"row": n, "errors": errors})
+
+    async def run(self, rows: Iterable[tuple[int, dict | None]]) -> dict:
+        started = time.perf_counter()
+        batch = []
+        for n, row in rows:
+            if row is None:
+                self.reject(n, "Malformed row")
+                continue
+            try:
+                batch.append((n, self.schema(**row)))
+            except ValidationError as e:
+                self.reject(n, json.loads(e.json(include_url=False, include_input=False)))  # no passwords echoed
+            if len(batch) >= self.batch_size:
+                await self.load(batch)
+                batch = []
+        if batch:
+            await self.load(batch)
+
+        seconds = time.perf_counter() - started
+        return {
+            "kind": self.kind,
+            "imported": self.imported,
+            "rejected": len(self.errors),
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(self.imported / seconds, 1) if seconds else None,
+            "errors": sorted(self.errors, key=lambda error: error["row"]),
+        }
+
+    async def taken(self, batch) -> dict[str, set]:
+        """
+        Values of the unique columns that already exist in the table, compared case-insensitively for email
+        """
+        first, _ = self.unique
+        names = [getattr(item, first) for _, item in batch]
+        emails = [item.email.lower() for _, item in batch]
+        result = await self.session.execute(
+            select(self.table.c[first], self.table.c.email).where(or_(
+                self.table.c[first].in_(names),
+                func.lower(self.table.c.email).in_(emails),
+            ))
+        )
+        taken = {first: set(), "email": set()}
+        for name, email in result.fetchall():
+            taken[first].add(name)
+            taken["email"].add(email.lower())
+        return taken
+
+    async def load(self, batch) -> None:
+        taken = await self.taken(batch)
+        accepted, in_batch = [], {field: set() for field in self.unique}
+        for n, item in batch:
+            values = {field: getattr(item, field) for field in self.unique}
+            values["email"] = values["email"].lower()
+            duplicate = [
+                field for field in self.unique
+                if values[field] in taken[field] or values[field] in self.seen[field] or values[field] in in_batch[field]
+            ]
+            if duplicate:
+                self.reject(n, f"{', '.join(duplicate)} already taken")
+                continue
+            for field in self.unique:
+                in_batch[field].add(values[field])
+            accepted.append((n, item))
+
+        if not accepted:
+            return
+
+        items = [item for _, item in accepted]
+        records = await (self.user_records(items) if self.kind == "users" else self.company_records(items))
+        try:
+            await self.copy(records)
+            await self.session.commit()
+        except Exception as e:
+            await self.session.rollback()
+            for n, _ in accepted:
+                self.reject(n, f"Batch failed: {e.__class__.__name__}")
+            return
+
+        for field in self.unique:  # only committed rows hold their values: a failed batch's rows may come again
+            self.seen[field].update(in_batch[field])
+        self.imported += len(records)
+        for record in records:
+            search_index.add(self.kind, self.projection.pick(record))
+        await search_index.publish(self.kind, *(record["id"] for record in records))
+        if self.kind == "users":
+            names = [record["username"] for record in records]
+            await usernames.announce(*names)
+            await cache.invalidate_many([f"profile:{name}" for name in names])  # drops cached "no such user"
+
+    async def user_records(self, items: list[UserCreate]) -> list[dict]:
+        hashes = await asyncio.gather(*(password_helper.hash_async(item.password) for item in items))
+        now = datetime.now()
+        return [
+            {
+                "id": uuid.uuid4(),
+                "email": item.email,
+                "username": item.username,
+                "hashed_password": hashed_password,
+                "first_name": None,
+                "last_name": None,
+                "balance": 0,
+                "role_id": 1,
+                "company_id": None,
+                "is_active": True,
+                "is_superuser": False,
+                "is_verified": False,
+                "register_at": now,
+            }
+            for item, hashed_password in zip(items, hashes)
+        ]
+
+    async def company_records(self, items: list[CompanyCreate]) -> list[dict]:
+        now = datetime.now()
+        return [
+            {
+                "id": uuid.uuid4(),
+                "email": item.email,
+                "name": item.name,
+                "description": item.description,
+                "address": item.address,
+                "contacts": item.contacts,
+                "is_active": True,
+                "register_at": now,
+            }
+            for item in items
+        ]
+
+    async def copy(self, records: list[dict]) -> None:
+        if self.session.bind.dialect.name != "postgresql":
+            await self.session.execute(insert(self.table), records)
+            return
+
+        columns = list(records[0])
+        encoded = {name for name in columns if isinstance(self.table.c[name].type, JSON)}  # asyncpg takes json as text
+        connection = await self.session.connection()
+        raw = await connection.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            self.table.name,
+            records=[
+                tuple(json.dumps(record[name]) if name in encoded else record[name] for name in columns)
+                for record in records
+            ],
+            columns=columns,
+        )
+
+
+async def import_file(kind: str, stream: Iterable[str], fmt: str, session: AsyncSession,
+                      batch_size: int = IMPORT_BATCH_SIZE) -> dict:
+    return await Importer(kind, session, batch_size).run(read_rows(stream, fmt))
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=["users", "companies"])
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["csv", "ndjson"])
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    with open(args.path, encoding="utf-8", newline="") as stream:
+        async with async_session_maker() as session:
+            report = await import_file(args.kind, stream, args.format or detect_format(args.path), session, args.batch_size)
+    print(json.dumps(report, indent=2, default=str))
+    password_helper.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
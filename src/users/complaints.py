@@ -0,0 +1,213 @@
+"""
+Batched complaint ingestion. The endpoint queues a validated complaint and answers 202 with its ingest id;
+a background task writes the queue with multi-row INSERTs once COMPLAINT_BATCH_SIZE complaints are waiting
+or every COMPLAINT_FLUSH_INTERVAL seconds, and once more on shutdown.
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from contextlib import suppress
+from datetime import datetime
+from typing import Any
+
+from fastapi import HTTPException
+from redis.asyncio import Redis
+from redis.exceptions import RedisError, ResponseError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from config import COMPLAINT_INGEST, COMPLAINT_BATCH_SIZE, COMPLAINT_FLUSH_INTERVAL, COMPLAINT_BUFFER_MAX, \
+    COMPLAINT_CLAIM_IDLE
+from src.database.cache import json_default
+from src.database.db_client import async_session_maker, redis_client
+from src.users.database import insert_complaints
+
+logger = logging.getLogger(__name__)
+
+def complaint_values(title: str, content: str, sender, addressee) -> dict:
+    return {
+        "ingest_id": uuid.uuid4(),
+        "title": title,
+        "content": content,
+        "sender": sender,
+        "addressee": addressee,
+        "register_at": datetime.now(),
+    }
+
+
+def decode(data: str) -> dict:
+    values = json.loads(data)
+    for field in ("ingest_id", "sender", "addressee"):
+        values[field] = uuid.UUID(values[field])
+    values["register_at"] = datetime.fromisoformat(values["register_at"])
+    return values
+
+
+class ComplaintBuffer:
+    """
+    mode "buffer": a list in this worker; flushed on shutdown, lost if the worker dies.
+    mode "stream": a Redis stream read through a consumer group. An entry is acknowledged only after its batch
+    is committed; entries left pending by a dead worker are claimed by the others after `claim_idle` ms.
+    Both may deliver a complaint twice, which the unique ingest_id absorbs.
+    A stream entry that cannot be decoded is moved to the "<stream>:dead" stream instead of blocking its batch
+    """
+
+    def __init__(self, mode: str, batch_size: int, interval: float, max_size: int, claim_idle: int,
+                 redis: Redis, session_maker: async_sessionmaker, stream: str = "complaints"):
+        self.mode = mode
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_size = max_size
+        self.claim_idle = claim_idle
+        self.redis = redis
+        self.session_maker = session_maker
+        self.stream = stream
+        self.dead_letters = f"{stream}:dead"
+        self.group = stream
+        self.consumer = uuid.uuid4().hex
+        self.pending = []
+        self.ready = asyncio.Event()
+        self.task = None
+        self.counters = {"queued": 0, "stored": 0, "dropped": 0, "batches": 0, "failed_batches": 0,
+                         "dead_letters": 0, "flush_seconds": 0.0}
+
+    async def submit(self, values: dict) -> None:
+        if self.mode == "stream":
+            try:
+                await self.redis.xadd(self.stream, {"complaint": json.dumps(values, default=json_default)})
+            except RedisError:
+                raise HTTPException(status_code=503, detail="Complaint queue is unavailable, try again later")
+        else:
+            if len(self.pending) >= self.max_size:
+                raise HTTPException(status_code=503, detail="Complaint queue is full, try again later")
+            self.pending.append(values)
+            if len(self.pending) >= self.batch_size:
+                self.ready.set()
+        self.counters["queued"] += 1
+
+    async def write(self, rows: list[dict]) -> None:
+        started = time.perf_counter()
+        try:
+            async with self.session_maker() as session:
+                stored, dropped = await insert_complaints(rows, session)
+        except (SQLAlchemyError, OSError):
+            self.counters["failed_batches"] += 1
+            raise
+        self.counters["stored"] += stored
+        self.counters["dropped"] += dropped
+        self.counters["batches"] += 1
+        self.counters["flush_seconds"] += time.perf_counter() - started
+
+    async def flush(self) -> None:
+        """
+        Writes everything queued in this worker. Only this method removes from the head of the list,
+        and submit only appends, so the head is stable while a batch is being written
+        """
+        while self.pending:
+            batch = self.pending[:self.batch_size]
+            await self.write(batch)
+            del self.pending[:len(batch)]
+
+    async def create_group(self) -> None:
+        try:
+            await self.redis.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def consume(self, position: str, block: int | None = None) -> int:
+        """
+        One batch from the group: position "0" re-reads what this consumer holds unacknowledged, ">" new entries
+        """
+        response = await self.redis.xreadgroup(
+            self.group, self.consumer, {self.stream: position}, count=self.batch_size, block=block,
+        )
+        entries = response[0][1] if response else []
+        if not entries:
+            return 0
+        rows = []
+        for entry_id, fields in entries:
+            try:
+                rows.append(decode(fields["complaint"]))
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                await self.dead_letter(entry_id, fields, e)
+        if rows:
+            await self.write(rows)
+        ids = [entry_id for entry_id, _ in entries]
+        await self.redis.xack(self.stream, self.group, *ids)
+        await self.redis.xdel(self.stream, *ids)
+        return len(entries)
+
+    async def dead_letter(self, entry_id: str, fields: dict, error: Exception) -> None:
+        logger.error("malformed complaint %s moved to %s: %r", entry_id, self.dead_letters, error)
+        await self.redis.xadd(self.dead_letters, {**fields, "entry_id": entry_id, "error": repr(error)})
+        self.counters["dead_letters"] += 1
+
+    async def claim(self) -> None:
+        await self.redis.xautoclaim(
+            self.stream, self.group, self.consumer, min_idle_time=self.claim_idle, count=self.batch_size,
+        )
+
+    async def drain(self) -> None:
+        if self.mode == "stream":
+            while await self.consume("0") or await self.consume(">"):
+                pass
+        else:
+            await self.flush()
+
+    async def run(self) -> None:
+        grouped, claimed_at = False, 0.0
+        while True:
+            try:
+                if self.mode == "stream":
+                    if not grouped:
+                        await self.create_group()
+                        grouped = True
+                    if time.monotonic() - claimed_at > self.claim_idle / 1000:
+                        await self.claim()
+                        claimed_at = time.monotonic()
+                    if await self.consume("0"):
+                        continue
+                    if await self.consume(">", block=int(self.interval * 1000)) < self.batch_size:
+                        await asyncio.sleep(self.interval)  # let a partial batch fill up before the next read
+                else:
+                    with suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(self.ready.wait(), self.interval)
+                    self.ready.clear()
+                    await self.flush()
+            except (SQLAlchemyError, OSError, RedisError) as e:
+                logger.warning("complaint flush failed, retrying: %r", e)
+                await asyncio.sleep(self.interval)  # the batch stays queued and is retried
+            except Exception:
+                logger.exception("complaint flusher error")
+                await asyncio.sleep(self.interval)  # keeps the flusher alive, whatever failed
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def close(self) -> None:
+        """
+        Stops the flusher and writes what is still queued in this worker
+        """
+        if self.task is not None:
+            self.task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.task
+            self.task = None
+        await self.drain()
+
+    def stats(self) -> dict[str, Any]:
+        return {**self.counters, "mode": self.mode, "waiting": len(self.pending)}
+
+
+complaints = ComplaintBuffer(
+    COMPLAINT_INGEST,
+    COMPLAINT_BATCH_SIZE,
+    COMPLAINT_FLUSH_INTERVAL,
+    COMPLAINT_BUFFER_MAX,
+    COMPLAINT_CLAIM_IDLE,
+    redis_client,
+    async_session_maker,
+)
@@ -1,20 +1,31 @@
 import uuid
+from base64 import urlsafe_b64decode
+from collections import defaultdict
 from datetime import datetime
 import json
 
+import orjson
 from fastapi import Depends, HTTPException
 from fastapi_users.db import SQLAlchemyUserDatabase
 from fastapi_users_db_sqlalchemy import SQLAlchemyBaseUserTable, SQLAlchemyBaseUserTableUUID
-from sqlalchemy import Integer, String, Boolean, ForeignKey, TIMESTAMP, func, JSON, select, update
+from sqlalchemy import Integer, String, Boolean, ForeignKey, TIMESTAMP, func, JSON, select, update, insert, tuple_, \
+    or_, and_, case
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.dialects.postgresql import UUID
 from typing import Optional, Any
 
-from src.users.models import role, user, company
-from src.database.db_client import Base, get_async_session, redis_client
-from src.users.schemas import UserRead, CompanyRead
-from src.users.utils import similarity_check
+from config import PROFILE_CACHE_TTL, NEGATIVE_CACHE_TTL
+from src.users.models import role, user, company, complaint, complaint_count
+from src.database.db_client import Base, get_async_session, get_read_session, cache_ttl
+from src.database.cache import cache
+from src.users.usernames import usernames
+from src.users.schemas import ComplaintRead
+from src.companies.schemas import CompanyRead
+from src.users.search import search_page, decode_cursor, encode_cursor
 
 """----------------------------------------------------TABLES--------------------------------------------------------------------------"""
 
@@ -57,6 +68,8 @@ class Complaint(Base): # on seller / company
     content: Mapped[str] = mapped_column(String, nullable=False)
     sender: Mapped[UUID] = mapped_column(UUID(as_uuid=True), ForeignKey(user.c.id))
     addressee: Mapped[UUID] = mapped_column(UUID(as_uuid=True), ForeignKey(user.c.id))
+    ingest_id: Mapped[Optional[UUID]] = mapped_column(UUID(as_uuid=True), unique=True)
+    is_active: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False)
     register_at: Mapped[datetime] = mapped_column(TIMESTAMP, default=func.now(), nullable=False)
 
 # class Product(Base):
@@ -74,61 +87,276 @@ async def get_session(session: AsyncSession = Depends(get_async_session)) -> Asy
     return session
 
 
-async def get_users_and_companies(current_row: str, session: AsyncSession) -> dict:
-    result = await session.execute(select(user))
-    users_data = result.fetchall()
-    result = await session.execute(select(company))
-    companies_data = result.fetchall()
-    return similarity_check(current_row, users_data, companies_data)
+async def get_read_only_session(session: AsyncSession = Depends(get_read_session)) -> AsyncSession:
+    """
+    Replica session for GET routes when a replica is configured, the primary otherwise
+    """
+    return session
+
+
+async def get_users_and_companies(current_row: str, session: AsyncSession, limit: int, cursor: str | None = None) -> dict:
+    return await search_page(current_row, session, limit, decode_cursor(cursor))
 
 
-async def get_user_by_username(username: str, session: AsyncSession) -> UserRead or None:
+async def get_profile(username: str, session: AsyncSession) -> dict | None:
+    """
+    User, role and company in one document, loaded with one joined query
+    """
     result = await session.execute(
-        select(user).where(user.c.username == username)
+        select(
+            user.c.username,
+            user.c.email,
+            user.c.first_name,
+            user.c.last_name,
+            user.c.is_verified,
+            user.c.register_at,
+            role.c.id.label("role_id"),
+            role.c.name.label("role_name"),
+            role.c.permissions,
+            company.c.id.label("company_id"),
+            company.c.email.label("company_email"),
+            company.c.name.label("company_name"),
+            company.c.description,
+            company.c.address,
+            company.c.contacts,
+            company.c.register_at.label("company_register_at"),
+        )
+        .select_from(
+            user.join(role, user.c.role_id == role.c.id)
+            .outerjoin(company, user.c.company_id == company.c.id)
+        )
+        .where(user.c.username == username)
     )
-    user_data = result.fetchone()
+    profile_data = result.fetchone()
+    if not profile_data:
+        return None
 
-    if not user_data:
+    profile = {
+        "username": profile_data.username,
+        "email": profile_data.email,
+        "first_name": profile_data.first_name,
+        "last_name": profile_data.last_name,
+        "role": {
+            "id": profile_data.role_id,
+            "name": profile_data.role_name,
+            "permissions": profile_data.permissions,
+        },
+        "company": None,
+        "is_verified": profile_data.is_verified,
+        "register_at": profile_data.register_at,
+    }
+    if profile_data.company_id is not None:
+        profile["company"] = CompanyRead(
+            id=profile_data.company_id,
+            email=profile_data.company_email,
+            name=profile_data.company_name,
+            description=profile_data.description,
+            address=profile_data.address,
+            contacts=profile_data.contacts,
+            register_at=profile_data.company_register_at,
+        ).model_dump(mode="json")
+
+    return profile
+
+
+async def get_profile_body(username: str, session: AsyncSession) -> bytes | None:
+    """
+    Serialized public profile, cached as the final response body; a hit is returned without parsing.
+    Owners' profiles are not public: they are cached as an empty body and come back as None
+    """
+    if not usernames.might_exist(username):
         return None
-    else:
-        return UserRead(
-            id=user_data[0],
-            email=user_data[1],
-            username=user_data[2],
-            first_name=user_data[4],
-            last_name=user_data[5],
-            role_id=user_data[7],
-            company_id=user_data[8],
-            is_verified=user_data[11],
-            register_at=user_data[-1],
+
+    async def load() -> bytes | None:
+        profile = await get_profile(username, session)
+        if profile is None:
+            return None
+        return b"" if profile["role"]["name"] == "owner" else orjson.dumps(profile)
+
+    body = await cache.fetch_versioned(
+        f"profile:{username}", load, cache_ttl(session, PROFILE_CACHE_TTL), raw=True, negative_ttl=NEGATIVE_CACHE_TTL,
+    )
+    return body or None
+
+
+async def invalidate_profiles(session: AsyncSession, company_id) -> None:
+    """
+    Profiles embed the company, so everyone linked to it has to be rebuilt
+    """
+    result = await session.execute(select(user.c.username).where(user.c.company_id == company_id))
+    await cache.invalidate_many([f"profile:{username}" for (username,) in result.fetchall()])
+
+
+async def invalidate_role_profiles(session: AsyncSession, role_ids) -> None:
+    """
+    Profiles embed the role and its permissions as well
+    """
+    if not role_ids:
+        return
+    result = await session.execute(select(user.c.username).where(user.c.role_id.in_(role_ids)))
+    await cache.invalidate_many([f"profile:{username}" for (username,) in result.fetchall()])
+
+
+async def user_exists(user_id, session: AsyncSession) -> bool:
+    result = await session.execute(select(user.c.id).where(user.c.id == user_id))
+    return result.first() is not None
+
+
+def dialect_insert(session: AsyncSession, table):
+    """
+    INSERT with ON CONFLICT clauses, on Postgres and on the SQLite used for local runs
+    """
+    return (pg_insert if session.bind.dialect.name == "postgresql" else sqlite_insert)(table)
+
+
+async def count_complaints(inserted, session: AsyncSession) -> None:
+    """
+    Adds freshly inserted (addressee, register_at) rows to complaint_count in the same transaction.
+    Counters are upserted in addressee order, so concurrent batches lock them in the same order
+    """
+    counts, last = defaultdict(int), dict()
+    for addressee, register_at in inserted:
+        if addressee is not None:
+            counts[addressee] += 1
+            last[addressee] = max(register_at, last.get(addressee, register_at))
+    if not counts:
+        return
+
+    statement = dialect_insert(session, complaint_count)
+    statement = statement.on_conflict_do_update(
+        index_elements=[complaint_count.c.addressee],
+        set_={
+            "count": complaint_count.c.count + statement.excluded.count,
+            "last_at": case(  # a claimed stream batch may be older than one already counted
+                (complaint_count.c.last_at > statement.excluded.last_at, complaint_count.c.last_at),
+                else_=statement.excluded.last_at,
+            ),
+        },
+    )
+    await session.execute(statement, [
+        {"addressee": addressee, "count": counts[addressee], "last_at": last[addressee]}
+        for addressee in sorted(counts, key=str)
+    ])
+
+
+async def insert_complaint(values: dict, session: AsyncSession) -> ComplaintRead:
+    result = await session.execute(
+        insert(complaint).values(values).returning(
+            complaint.c.id, complaint.c.title, complaint.c.content,
+            complaint.c.sender, complaint.c.addressee, complaint.c.register_at,
         )
+    )
+    complaint_read = ComplaintRead(**result.mappings().one())
+    await count_complaints([(complaint_read.addressee, complaint_read.register_at)], session)
+    await session.commit()
+    return complaint_read
+
+
+async def insert_complaints(rows: list[dict], session: AsyncSession) -> tuple[int, int]:
+    """
+    One multi-row INSERT; rows already stored under the same ingest_id are skipped and not counted again.
+    If the batch violates a constraint (an addressee deleted meanwhile), rows are retried one by one
+    and the offending ones dropped. Returns (inserted or already stored, dropped)
+    """
+    statement = dialect_insert(session, complaint).on_conflict_do_nothing(index_elements=[complaint.c.ingest_id])
+    try:
+        result = await session.execute(statement.returning(complaint.c.addressee, complaint.c.register_at), rows)
+        await count_complaints(result.all(), session)
+        await session.commit()
+        return len(rows), 0
+    except IntegrityError:
+        await session.rollback()
+        if len(rows) == 1:
+            return 0, 1
+
+    stored = dropped = 0
+    for row in rows:
+        ok, failed = await insert_complaints([row], session)
+        stored, dropped = stored + ok, dropped + failed
+    return stored, dropped
+
+
+def decode_position(cursor: str | None, *fields: str) -> tuple | None:
+    if cursor is None:
+        return None
+    try:
+        position = json.loads(urlsafe_b64decode(cursor.encode()))
+        return tuple(position[field] for field in fields)
+    except (ValueError, TypeError, KeyError, AttributeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def list_complaints(addressee, session: AsyncSession, limit: int, cursor: str | None = None) -> dict:
+    """
+    Complaints against `addressee`, newest first.
+    Keyset on (register_at, id): every page is a range scan of the matching composite index
+    """
+    query = select(
+        complaint.c.id, complaint.c.title, complaint.c.content,
+        complaint.c.sender, complaint.c.addressee, complaint.c.register_at,
+    ).where(complaint.c.addressee == addressee)
+
+    after = decode_position(cursor, "register_at", "id")
+    if after is not None:
+        try:
+            register_at, complaint_id = datetime.fromisoformat(after[0]), int(after[1])
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(tuple_(complaint.c.register_at, complaint.c.id) < (register_at, complaint_id))
+
+    result = await session.execute(query.order_by(complaint.c.register_at.desc(), complaint.c.id.desc()).limit(limit))
+    items = [ComplaintRead(**n) for n in result.mappings().all()]
+    next_cursor = None
+    if len(items) == limit:
+        last = items[-1]
+        next_cursor = encode_cursor({"register_at": last.register_at.isoformat(), "id": last.id})
+    return {"items": items, "next_cursor": next_cursor}
+
+
+async def list_complaint_counts(session: AsyncSession, limit: int, cursor: str | None = None) -> dict:
+    """
+    Most complained-about users first, read from complaint_count; keyset on (count, addressee)
+    """
+    query = (
+        select(complaint_count.c.addressee, user.c.username, user.c.company_id,
+               complaint_count.c.count, complaint_count.c.last_at)
+        .select_from(complaint_count.join(user, complaint_count.c.addressee == user.c.id))
+    )
+
+    after = decode_position(cursor, "count", "addressee")
+    if after is not None:
+        try:
+            count, addressee = int(after[0]), uuid.UUID(after[1])
+        except (ValueError, TypeError, AttributeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(or_(
+            complaint_count.c.count < count,
+            and_(complaint_count.c.count == count, complaint_count.c.addressee > addressee),
+        ))
+
+    result = await session.execute(
+        query.order_by(complaint_count.c.count.desc(), complaint_count.c.addressee).limit(limit)
+    )
+    items = [dict(n) for n in result.mappings().all()]
+    next_cursor = None
+    if len(items) == limit:
+        last = items[-1]
+        next_cursor = encode_cursor({"count": last["count"], "addressee": str(last["addressee"])})
+    return {"items": items, "next_cursor": next_cursor}
 
 
+async def get_complaint_count(addressee, session: AsyncSession) -> int:
+    result = await session.execute(select(complaint_count.c.count).where(complaint_count.c.addressee == addressee))
+    return result.scalar() or 0
 
-async def get_role_by_id(role_id: int, session: AsyncSession) -> dict:
-    redis_key = f"role:{role_id}"
-    cached_role = await redis_client.get(redis_key)
-    if cached_role:
-        role_data = json.loads(cached_role)
-        return {
-            "id": role_data["id"],
-            "name": role_data["name"],
-            "permissions": role_data["permissions"],
-        }
 
+async def get_company_complaint_count(company_id, session: AsyncSession) -> int:
+    """
+    Sum of the counters of the company's users: a join of two small indexed sets, not a complaint scan
+    """
     result = await session.execute(
-        select(role).where(role.c.id == role_id)
+        select(func.coalesce(func.sum(complaint_count.c.count), 0))
+        .select_from(complaint_count.join(user, complaint_count.c.addressee == user.c.id))
+        .where(user.c.company_id == company_id)
     )
-    role_data = result.fetchone()
-
-    if not role_data:
-        raise HTTPException(status_code=404, detail=f"Role with id {role_id} not found.")
-    else:
-        role_dict = {"id": role_data[0], "name": role_data[1], "permissions": role_data[2]}
-        await redis_client.setex(redis_key, 86400, json.dumps(role_dict))
-
-        return {
-            "id": role_dict['id'],
-            "name": role_dict['name'],
-            "permissions": role_dict['permissions'],
-        }
\ No newline at end of file
+    return result.scalar()
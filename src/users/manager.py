@@ -3,23 +3,119 @@ from fastapi import Depends, HTTPException
 from fastapi_users import BaseUserManager, UUIDIDMixin
 from typing import Optional
 from fastapi import Request
+from fastapi.security import OAuth2PasswordRequestForm
 from fastapi_users import exceptions, models, schemas
+from sqlalchemy import select, or_, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached
 
-from src.database.db_client import async_session_maker
+from config import AUTH_USER_CACHE_TTL
+from src.database.cache import cache
+from src.database.metrics import add
 from src.users.database import User, get_user_db
 from src.users.models import user
+from src.users.search import search_index
+from src.users.usernames import usernames
+from src.users.password import password_helper
 
 
 SECRET = "SECRET"
 
+# unique constraints and indexes on "user" that a concurrent signup can violate
+USERNAME_CONSTRAINTS = {"user_username_key"}
+EMAIL_CONSTRAINTS = {"uq_user_email_lower", "ix_user_email"}
+
+
+def user_values(user: User) -> dict:
+    return {attr.key: getattr(user, attr.key) for attr in User.__mapper__.column_attrs}
+
+
+def violated_constraint(error: IntegrityError) -> str | None:
+    """
+    Name of the constraint behind an IntegrityError, as asyncpg reports it on the driver error
+    """
+    return getattr(error.orig.__cause__, "constraint_name", None)
+
+
+def detached_user(values: dict) -> User:
+    """
+    A fresh instance per request: it can be attached to the request's session like a loaded row,
+    without the cached one being shared between sessions
+    """
+    user = User(**values)
+    make_transient_to_detached(user)
+    return user
+
 
 class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
     reset_password_token_secret = SECRET
     verification_token_secret = SECRET
 
 
+    async def get(self, id: models.ID) -> models.UP:
+        """
+        current_user resolves the token's user through here; with AUTH_USER_CACHE_TTL set,
+        the row is kept in the worker's memory under the user's cache version
+        """
+        if AUTH_USER_CACHE_TTL <= 0:
+            return await super().get(id)
+
+        key = f"auth:{id}"
+        versioned_key = f"{key}:v{await cache.version(key)}"
+        values = cache.get_local(versioned_key)
+        if values is not None:
+            add("cache_hits")
+            return detached_user(values)
+
+        add("cache_misses")
+        user = await super().get(id)
+        cache.set_local(versioned_key, user_values(user), AUTH_USER_CACHE_TTL)
+        return user
+
+
     async def on_after_register(self, user: User, request: Optional[Request] = None):
         print(f"User {user.id} has registered.")
+        search_index.add_user(user)
+        await search_index.publish("users", user.id)
+        await usernames.announce(user.username)
+        await cache.invalidate(f"profile:{user.username}")  # drops a cached "no such user"
+
+
+    async def update(
+            self,
+            user_update: schemas.UU,
+            user: models.UP,
+            safe: bool = False,
+            request: Optional[Request] = None,
+    ) -> models.UP:
+        username = user.username
+        updated_user = await super().update(user_update, user, safe, request)
+        await cache.invalidate(f"profile:{username}")
+        if updated_user.username != username:
+            await usernames.announce(updated_user.username)
+            await cache.invalidate(f"profile:{updated_user.username}")
+        return updated_user
+
+
+    async def on_after_update(self, user: User, update_dict: dict, request: Optional[Request] = None):
+        search_index.add_user(user)
+        await search_index.publish("users", user.id)
+        await cache.invalidate(f"auth:{user.id}")
+
+
+    async def on_after_verify(self, user: User, request: Optional[Request] = None):
+        await cache.invalidate(f"auth:{user.id}")
+
+
+    async def on_after_reset_password(self, user: User, request: Optional[Request] = None):
+        await cache.invalidate(f"auth:{user.id}")
+
+
+    async def on_after_delete(self, user: User, request: Optional[Request] = None):
+        search_index.remove("users", user.id)
+        await search_index.publish("users", user.id)
+        await cache.invalidate(f"profile:{user.username}")
+        await cache.invalidate(f"auth:{user.id}")
 
 
     async def create(
@@ -29,16 +125,20 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
             request: Optional[Request] = None,
     ) -> models.UP:
 
-        async with async_session_maker() as session:
-            result = await session.execute(user.select().where(user.c.username == user_create.username))
-            user_status = result.fetchone()
-            if user_status:
-                raise HTTPException(status_code=400, detail="Username is already taken")
+        # One query for both unique fields; the constraints still decide if a concurrent signup wins
+        result = await self.user_db.session.execute(
+            select(user.c.username).where(or_(
+                user.c.username == user_create.username,
+                func.lower(user.c.email) == func.lower(user_create.email),
+            ))
+        )
+        taken = result.fetchall()
+        if any(row.username == user_create.username for row in taken):
+            raise HTTPException(status_code=400, detail="Username is already taken")
 
         await self.validate_password(user_create.password, user_create)
 
-        existing_user = await self.user_db.get_by_email(user_create.email)
-        if existing_user is not None:
+        if taken:
             raise exceptions.UserAlreadyExists()
 
         user_dict = (
@@ -48,16 +148,47 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
         )
 
         password = user_dict.pop("password")
-        user_dict["hashed_password"] = self.password_helper.hash(password)
+        user_dict["hashed_password"] = await self.password_helper.hash_async(password)
         user_dict["role_id"] = 1
 
-        created_user = await self.user_db.create(user_dict)
+        try:
+            created_user = await self.user_db.create(user_dict)
+        except IntegrityError as e:
+            await self.user_db.session.rollback()
+            constraint = violated_constraint(e)
+            if constraint in USERNAME_CONSTRAINTS:
+                raise HTTPException(status_code=400, detail="Username is already taken")
+            if constraint in EMAIL_CONSTRAINTS:
+                raise exceptions.UserAlreadyExists()
+            raise
 
         await self.on_after_register(created_user, request)
 
         return created_user
 
 
+    async def authenticate(self, credentials: OAuth2PasswordRequestForm) -> Optional[models.UP]:
+        """
+        Same as BaseUserManager.authenticate, with the password check moved off the event loop
+        """
+        try:
+            user = await self.get_by_email(credentials.username)
+        except exceptions.UserNotExists:
+            # Run the hasher to mitigate timing attack
+            await self.password_helper.hash_async(credentials.password)
+            return None
+
+        verified, updated_password_hash = await self.password_helper.verify_and_update_async(
+            credentials.password, user.hashed_password
+        )
+        if not verified:
+            return None
+        if updated_password_hash is not None:
+            await self.user_db.update(user, {"hashed_password": updated_password_hash})
+
+        return user
+
+
     async def on_after_forgot_password(
         self, user: User, token: str, request: Optional[Request] = None
     ):
@@ -71,4 +202,4 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
 
 
 async def get_user_manager(user_db=Depends(get_user_db)):
-    yield UserManager(user_db)
\ No newline at end of file
+    yield UserManager(user_db, password_helper)
\ No newline at end of file
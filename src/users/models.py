@@ -1,6 +1,6 @@
 import uuid
 
-from sqlalchemy import Table, Column, MetaData, Integer, String, TIMESTAMP, ForeignKey, JSON, Boolean, func
+from sqlalchemy import Table, Column, MetaData, Integer, String, TIMESTAMP, ForeignKey, JSON, Boolean, Index, func
 from src.companies.models import company
 from sqlalchemy.dialects.postgresql import UUID
 
@@ -35,13 +35,29 @@ user = Table(
     Column("register_at", TIMESTAMP, default=func.now()),
 )
 
+Index("uq_user_email_lower", func.lower(user.c.email), unique=True)
+
 complaint = Table(
     "complaint",
     user_metadata,
     Column("id", Integer, primary_key=True),
     Column("title", String(length=200), nullable=False),
     Column("content",String, nullable=False),
-    Column("user_id", UUID(as_uuid=True), ForeignKey(user.c.id)),
+    Column("sender", UUID(as_uuid=True), ForeignKey(user.c.id)),
+    Column("addressee", UUID(as_uuid=True), ForeignKey(user.c.id)),
+    Column("ingest_id", UUID(as_uuid=True), unique=True),  # idempotency key of batched ingestion
     Column("is_active", Boolean, default=True, nullable=False),
     Column("register_at", TIMESTAMP, server_default=func.now(), nullable=False),
-)
\ No newline at end of file
+)
+# "latest complaints against X": an index range scan in (register_at, id) order, read backwards
+Index("ix_complaint_addressee_register_at_id", complaint.c.addressee, complaint.c.register_at, complaint.c.id)
+
+complaint_count = Table(
+    "complaint_count",
+    user_metadata,
+    Column("addressee", UUID(as_uuid=True), ForeignKey(user.c.id), primary_key=True),
+    Column("count", Integer, nullable=False, default=0),
+    Column("last_at", TIMESTAMP),
+)
+
+Index("ix_complaint_count_count_addressee", complaint_count.c.count, complaint_count.c.addressee)
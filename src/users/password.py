@@ -0,0 +1,64 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi_users.password import PasswordHelper
+
+from config import PASSWORD_HASH_CONCURRENCY
+from src.database.metrics import add
+
+
+class ExecutorPasswordHelper(PasswordHelper):
+    """
+    PasswordHelper with async variants that hash on a thread pool instead of the event loop.
+    argon2-cffi and bcrypt release the GIL while hashing, so threads are enough to use every core;
+    at most `concurrency` hashes run at once, the rest wait in line and are counted in stats()
+    """
+
+    def __init__(self, concurrency: int, password_hash=None):
+        super().__init__(password_hash)
+        self.concurrency = concurrency
+        self.executor = None
+        self.start()
+        self.counters = {"waiting": 0, "running": 0, "completed": 0, "wait_seconds": 0.0, "hash_seconds": 0.0}
+
+    async def run(self, func, *args):
+        self.counters["waiting"] += 1
+        queued = time.perf_counter()
+        async with self.semaphore:
+            started = time.perf_counter()
+            self.counters["waiting"] -= 1
+            self.counters["running"] += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+            finally:
+                self.counters["running"] -= 1
+                self.counters["completed"] += 1
+                self.counters["wait_seconds"] += started - queued
+                self.counters["hash_seconds"] += time.perf_counter() - started
+                add("hash_seconds", time.perf_counter() - started)
+
+    async def hash_async(self, password: str) -> str:
+        return await self.run(self.hash, password)
+
+    async def verify_and_update_async(self, plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+        return await self.run(self.verify_and_update, plain_password, hashed_password)
+
+    def stats(self) -> dict[str, float]:
+        return dict(self.counters)
+
+    def start(self) -> None:
+        """
+        A new pool after shutdown(), for an app that is started again in the same process
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="password")
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+password_helper = ExecutorPasswordHelper(PASSWORD_HASH_CONCURRENCY)
@@ -0,0 +1,73 @@
+from typing import Mapping
+
+from pydantic import BaseModel
+from sqlalchemy import Column, Select, Table, select
+
+from src.users.models import user, company
+from src.users.schemas import UserRead
+from src.companies.schemas import CompanyRead
+
+
+class Projection:
+    """
+    The columns one read model needs, selected by name and mapped back by name, so queries skip
+    the columns nobody reads (hashed_password, balance, ...) and do not depend on the table's column order.
+    Checked when the module is imported: every column must belong to `table` and be a field of `model`,
+    and every required field of `model` must be selected
+    """
+
+    def __init__(self, model: type[BaseModel], table: Table, *columns: Column):
+        self.model = model
+        self.table = table
+        self.columns = columns
+        self.names = tuple(column.key for column in columns)
+
+        foreign = [column.key for column in columns if column.table is not table]
+        unknown = [name for name in self.names if name not in model.model_fields]
+        missing = [name for name, field in model.model_fields.items() if field.is_required() and name not in self.names]
+        if foreign or unknown or missing:
+            raise ValueError(
+                f"{model.__name__} projection of {table.name}: foreign {foreign}, unknown {unknown}, missing {missing}"
+            )
+
+    def select(self, *extra) -> Select:
+        return select(*self.columns, *extra)
+
+    def pick(self, row: Mapping) -> dict:
+        return {name: row[name] for name in self.names}
+
+    def from_entity(self, entity) -> dict:
+        """
+        Same mapping as a selected row, from an ORM object
+        """
+        return {name: getattr(entity, name) for name in self.names}
+
+    def read(self, row: Mapping):
+        return self.model(**self.pick(row))
+
+
+USER_READ = Projection(
+    UserRead,
+    user,
+    user.c.id,
+    user.c.email,
+    user.c.username,
+    user.c.first_name,
+    user.c.last_name,
+    user.c.role_id,
+    user.c.company_id,
+    user.c.is_verified,
+    user.c.register_at,
+)
+
+COMPANY_READ = Projection(
+    CompanyRead,
+    company,
+    company.c.id,
+    company.c.email,
+    company.c.name,
+    company.c.description,
+    company.c.address,
+    company.c.contacts,
+    company.c.register_at,
+)
@@ -0,0 +1,103 @@
+from copy import deepcopy
+from types import MappingProxyType
+from typing import Any, NamedTuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.db_client import async_session_maker
+from src.users.models import role
+
+
+class RoleEntry(NamedTuple):
+    id: int
+    name: str
+    permissions: Any
+    mask: int
+
+
+def granted(permissions) -> list[str]:
+    """
+    permissions JSON is either a list of names or an object of name -> flag
+    """
+    if isinstance(permissions, dict):
+        return [str(name) for name, value in permissions.items() if value]
+    if isinstance(permissions, (list, tuple)):
+        return [str(name) for name in permissions]
+    return []
+
+
+class RoleTable:
+    """
+    Immutable snapshot of the role table. Every permission name gets a bit,
+    so a permission check is a single AND against the role's precomputed mask
+    """
+
+    def __init__(self, rows=(), loaded: bool = False):
+        names = sorted({name for row in rows for name in granted(row[2])})
+        self.loaded = loaded
+        self.bits = MappingProxyType({name: 1 << i for i, name in enumerate(names)})
+        self.by_id = MappingProxyType({
+            row[0]: RoleEntry(row[0], row[1], deepcopy(row[2]), self.mask(*granted(row[2])))
+            for row in rows
+        })
+
+    def mask(self, *permissions: str) -> int | None:
+        """
+        None when a permission is unknown: no role can grant it
+        """
+        mask = 0
+        for name in permissions:
+            bit = self.bits.get(name)
+            if bit is None:
+                return None
+            mask |= bit
+        return mask
+
+    def allows(self, role_id: int, *permissions: str) -> bool:
+        entry = self.by_id.get(role_id)
+        required = self.mask(*permissions)
+        if entry is None or required is None:
+            return False
+        return entry.mask & required == required
+
+
+class Roles:
+    """
+    Holder of the current RoleTable; a reload swaps the whole snapshot at once
+    """
+
+    def __init__(self):
+        self.table = RoleTable()
+
+    @property
+    def loaded(self) -> bool:
+        return self.table.loaded
+
+    def get(self, role_id: int) -> dict | None:
+        entry = self.table.by_id.get(role_id)
+        if entry is None:
+            return None
+        return {"id": entry.id, "name": entry.name, "permissions": deepcopy(entry.permissions)}
+
+    def allows(self, role_id: int, *permissions: str) -> bool:
+        return self.table.allows(role_id, *permissions)
+
+    async def load(self, session: AsyncSession) -> set[int]:
+        """
+        Returns the ids of the roles added, removed or edited since the previous snapshot
+        """
+        result = await session.execute(select(role))
+        before, self.table = self.table.by_id, RoleTable(result.fetchall(), loaded=True)
+        return {
+            role_id for role_id in before.keys() | self.table.by_id.keys()
+            if role_id not in before or role_id not in self.table.by_id
+            or before[role_id][1:3] != self.table.by_id[role_id][1:3]
+        }
+
+    async def reload(self) -> None:
+        async with async_session_maker() as session:
+            await self.load(session)
+
+
+roles = Roles()
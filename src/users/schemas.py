@@ -40,20 +40,33 @@ class UserUpdate(schemas.BaseUserUpdate):
     first_name: Optional[str] = Field(default=None, max_length=30, pattern=r"^[A-Za-z]+$")
     last_name: Optional[str] = Field(default=None, max_length=30, pattern=r"^[A-Za-z]+$")
 
+    def create_update_dict(self):
+        """
+        PATCH /users/me: the role grants permissions and the company is assigned when it is created,
+        so only a superuser (PATCH /users/{id}) may change them
+        """
+        update_dict = super().create_update_dict()
+        update_dict.pop("role_id", None)
+        update_dict.pop("company_id", None)
+        return update_dict
+
 
 
 class ComplaintRead(BaseModel):
+    id: int
     title: str
     content: str
-    sender_id: uuid.UUID
-    company_id: uuid.UUID
+    sender: uuid.UUID
+    addressee: uuid.UUID
     register_at: datetime
 
 
 class ComplaintCreate(BaseModel):
-    id: uuid.UUID
-    title: str
-    content: str
-    sender: uuid.UUID
+    title: str = Field(min_length=1, max_length=200)
+    content: str = Field(min_length=1)
     addressee: uuid.UUID
-    register_at: datetime
\ No newline at end of file
+
+
+class ComplaintAccepted(BaseModel):
+    id: uuid.UUID
+    status: str = "queued"
\ No newline at end of file
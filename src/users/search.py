@@ -0,0 +1,373 @@
+import json
+import time
+import uuid
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from collections import defaultdict, OrderedDict
+
+from fastapi import HTTPException
+from sqlalchemy import func, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from config import SEARCH_BACKEND, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SEARCH_CACHE_STATES
+from src.database.cache import cache
+from src.database.db_client import async_session_maker
+from src.database.metrics import timed
+from src.users.models import user, company
+from src.users.projections import USER_READ, COMPANY_READ
+from src.users.utils import top_similar, top_weighted, normalize, match_masks, lcs_state
+
+
+NGRAM_SIZE = 3
+
+KINDS = {
+    "users": (USER_READ, user.c.username),
+    "companies": (COMPANY_READ, company.c.name),
+}
+
+
+class SearchCache:
+    """
+    LRU + TTL cache of typeahead results, keyed by (kind, normalized query).
+    An entry holds the bit-parallel LCS state of every candidate name,
+    so a longer query continues from its longest cached prefix instead of rescoring from scratch.
+    Bounded by queries and by the states held in total: a short query matches a large share of the rows,
+    and one with more than `max_states` candidates is not cached at all.
+    """
+
+    def __init__(self, maxsize: int = SEARCH_CACHE_SIZE, ttl: float = SEARCH_CACHE_TTL,
+                 max_states: int = SEARCH_CACHE_STATES):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_states = max_states
+        self.entries = OrderedDict()  # (kind, query) -> (expires_at, {name: state})
+
+    def get(self, kind: str, query: str) -> dict[str, int] | None:
+        entry = self.entries.get((kind, query))
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.entries[(kind, query)]
+            return None
+        self.entries.move_to_end((kind, query))
+        return entry[1]
+
+    def put(self, kind: str, query: str, states: dict[str, int]) -> None:
+        if self.maxsize <= 0 or len(states) > self.max_states:
+            return
+        self.entries[(kind, query)] = (time.monotonic() + self.ttl, states)
+        self.entries.move_to_end((kind, query))
+        cached = self.states_count()  # entries gain and lose names as rows change, so counted here
+        while len(self.entries) > self.maxsize or cached > self.max_states:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            cached -= len(evicted)
+
+    def states_count(self) -> int:
+        return sum(len(entry[1]) for entry in self.entries.values())
+
+    def items(self, kind: str):
+        return [(key[1], entry[1]) for key, entry in self.entries.items() if key[0] == kind]
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+class SearchIndex:
+    """
+    Inverted n-gram index over usernames and company names.
+    Rows are the USER_READ / COMPANY_READ mappings a table scan would select,
+    so the candidates are ranked by the same engine as a full table scan.
+    Every worker holds its own copy: a change is applied locally and published, see publish()
+    """
+
+    kinds = ("users", "companies")
+
+    def __init__(self, size: int = NGRAM_SIZE):
+        self.size = size
+        self.clear()
+
+    def clear(self) -> None:
+        self.ready = False
+        self.rows = {kind: dict() for kind in self.kinds}        # name -> row
+        self.names = {kind: dict() for kind in self.kinds}       # id -> name
+        self.masks = {kind: dict() for kind in self.kinds}       # name -> (match masks, length)
+        self.postings = {kind: defaultdict(set) for kind in self.kinds}  # gram -> names
+        self.cache = SearchCache()
+        self.building = None  # kind -> ids refreshed while a build is reading the tables
+
+    def grams(self, row: str) -> set[str]:
+        """
+        n-grams of the normalized string. Single characters are indexed too,
+        so queries shorter than the n-gram size still find every row they can match.
+        """
+        row = normalize(row)
+        grams = set(row)
+        grams.update(row[i:i + self.size] for i in range(len(row) - self.size + 1))
+        return grams
+
+    def query_grams(self, current_row: str) -> set[str]:
+        row = normalize(current_row)
+        if len(row) < self.size:
+            return set(row)
+        return {row[i:i + self.size] for i in range(len(row) - self.size + 1)}
+
+    def add(self, kind: str, row) -> None:
+        _, column = KINDS[kind]
+        row_id, name = row["id"], row[column.key]
+        previous = self.names[kind].get(row_id)
+        if previous is not None and previous != name:
+            self.remove(kind, row_id)
+
+        self.rows[kind][name] = row
+        if previous == name:
+            return
+
+        self.names[kind][row_id] = name
+        normalized = normalize(name)
+        self.masks[kind][name] = (match_masks(normalized), len(normalized))
+        grams = self.grams(name)
+        for gram in grams:
+            self.postings[kind][gram].add(name)
+
+        for query, states in self.cache.items(kind):
+            if grams & self.query_grams(query):
+                states[name] = self.state(kind, name, query)
+
+    def add_user(self, entity) -> None:
+        self.add("users", USER_READ.from_entity(entity))
+
+    def add_company(self, entity) -> None:
+        self.add("companies", COMPANY_READ.from_entity(entity))
+
+    def remove(self, kind: str, row_id) -> None:
+        name = self.names[kind].pop(row_id, None)
+        if name is None:
+            return
+        self.rows[kind].pop(name, None)
+        self.masks[kind].pop(name, None)
+        for _, states in self.cache.items(kind):
+            states.pop(name, None)
+        for gram in self.grams(name):
+            names = self.postings[kind].get(gram)
+            if names is None:
+                continue
+            names.discard(name)
+            if not names:
+                del self.postings[kind][gram]
+
+    def candidates(self, kind: str, grams) -> set[str]:
+        names = set()
+        for gram in grams:
+            names.update(self.postings[kind].get(gram, ()))
+        return names
+
+    def state(self, kind: str, name: str, query: str, state: int | None = None) -> int:
+        masks, length = self.masks[kind][name]
+        return lcs_state(masks, length, query, state)
+
+    def reusable_prefix(self, kind: str, query: str):
+        """
+        Longest cached prefix whose candidates are a subset of the query's ones:
+        every n-gram of a prefix is an n-gram of the query, unless only the query
+        is long enough to be split into n-grams instead of single characters
+        """
+        shortest = 1 if len(query) < self.size else self.size
+        for end in range(len(query) - 1, shortest - 1, -1):
+            states = self.cache.get(kind, query[:end])
+            if states is not None:
+                return query[:end], states
+        return None, None
+
+    def states(self, kind: str, query: str) -> dict[str, int]:
+        states = self.cache.get(kind, query)
+        if states is not None:
+            return states
+
+        prefix, cached = self.reusable_prefix(kind, query)
+        if prefix is None:
+            states = {name: self.state(kind, name, query) for name in self.candidates(kind, self.query_grams(query))}
+        else:
+            tail = query[len(prefix):]
+            states = {name: self.state(kind, name, tail, state) for name, state in cached.items()}
+            for name in self.candidates(kind, self.query_grams(query) - self.query_grams(prefix)):
+                if name not in states:
+                    states[name] = self.state(kind, name, query)
+
+        self.cache.put(kind, query, states)
+        return states
+
+    def weights(self, kind: str, states: dict[str, int]):
+        masks = self.masks[kind]
+        for name, state in states.items():
+            yield name, masks[name][1] - state.bit_count()
+
+    def top(self, kind: str, current_row: str, limit: int, after: tuple | None = None) -> list[tuple[str, int]]:
+        """
+        The best n-gram candidates. Approximate: a name that shares characters with the query
+        but no n-gram is not ranked, although a full scan would rank it (e.g. "acxme_store" for "acme")
+        """
+        query = normalize(current_row)
+        if not query:
+            return []
+        return top_weighted(self.weights(kind, self.states(kind, query)), limit, after)
+
+    async def build(self, session: AsyncSession) -> None:
+        """
+        Reads the tables into fresh structures and swaps them in at the end,
+        so searches keep using the current index while a rebuild runs
+        """
+        fresh = SearchIndex(self.size)
+        self.building = {kind: set() for kind in self.kinds}
+        try:
+            for kind, (projection, _) in KINDS.items():
+                result = await session.execute(projection.select())
+                for row in result.mappings():
+                    fresh.add(kind, row)
+            self.rows, self.names, self.masks, self.postings, self.cache = (
+                fresh.rows, fresh.names, fresh.masks, fresh.postings, fresh.cache,
+            )
+            self.ready = True
+            refreshed, self.building = self.building, None
+            for kind, ids in refreshed.items():  # the build may have read them before they changed
+                if ids:
+                    await self.refresh(kind, ids, session)
+        finally:
+            self.building = None
+
+    async def reload(self) -> None:
+        async with async_session_maker() as session:
+            await self.build(session)
+
+    async def refresh(self, kind: str, ids, session: AsyncSession | None = None) -> None:
+        """
+        Re-reads the rows with these ids: changed ones are indexed again, deleted ones removed
+        """
+        if session is None:
+            async with async_session_maker() as session:
+                return await self.refresh(kind, ids, session)
+
+        if self.building is not None:
+            self.building[kind].update(ids)
+        projection, _ = KINDS[kind]
+        result = await session.execute(projection.select().where(projection.table.c.id.in_(ids)))
+
+        found = set()
+        for row in result.mappings():
+            self.add(kind, row)
+            found.add(row["id"])
+        for row_id in set(ids) - found:
+            self.remove(kind, row_id)
+
+    async def publish(self, kind: str, *ids) -> None:
+        """
+        Tells the other workers that these rows changed, after they were applied here
+        """
+        if SEARCH_BACKEND == "index" and ids:
+            await cache.publish(f"search:{kind}:{','.join(str(row_id) for row_id in ids)}")
+
+    def changed(self, message: str):
+        """
+        Watcher of the "search:" keys published by another worker
+        """
+        kind, ids = message.split(":", 1)
+        return self.refresh(kind, [uuid.UUID(row_id) for row_id in ids.split(",")])
+
+
+search_index = SearchIndex()
+
+
+def encode_cursor(position: dict) -> str:
+    return urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor: str | None) -> dict | None:
+    """
+    Cursor holds the last (weight, name) returned for every kind that is not exhausted yet
+    """
+    if cursor is None:
+        return None
+    try:
+        position = json.loads(urlsafe_b64decode(cursor.encode()))
+        position = {kind: (weight, name) for kind, (weight, name) in position.items() if kind in KINDS}
+    except (ValueError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    for weight, name in position.values():
+        if isinstance(weight, bool) or not isinstance(weight, (int, float)) or not isinstance(name, str):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return position
+
+
+async def rank(kind: str, current_row: str, session: AsyncSession, limit: int, after: tuple | None = None):
+    """
+    Yields (weight, row) of one kind, best first, starting right after the `after` keyset position
+    """
+    projection, column = KINDS[kind]
+
+    if SEARCH_BACKEND == "postgres" and session.bind.dialect.name == "postgresql":
+        # pg_trgm: `%` goes through the GIN trigram index, only `limit` rows leave Postgres
+        row = normalize(current_row)
+        weight = func.similarity(column, row)
+        query = projection.select(weight.label("weight")).where(column.op("%")(row))
+        if after is not None:
+            query = query.where(or_(weight < after[0], and_(weight == after[0], column > after[1])))
+        result = await session.stream(query.order_by(weight.desc(), column).limit(limit))
+        async for n in result.mappings():
+            yield n["weight"], n
+        return
+
+    if SEARCH_BACKEND == "index" and search_index.ready:
+        rows = search_index.rows[kind]
+        with timed("similarity_seconds"):
+            ranked = search_index.top(kind, current_row, limit, after)
+        for name, weight in ranked:
+            yield weight, rows[name]
+        return
+
+    result = await session.execute(projection.select())
+    rows = {n[column.key]: n for n in result.mappings()}
+    with timed("similarity_seconds"):
+        ranked = top_similar(current_row, rows, limit, after)
+    for name, weight in ranked:
+        yield weight, rows[name]
+
+
+async def search_page(current_row: str, session: AsyncSession, limit: int, position: dict | None) -> dict:
+    answer, next_position = dict(), dict()
+
+    for kind, (projection, column) in KINDS.items():
+        answer[kind] = dict()
+        if position is not None and kind not in position:
+            continue
+
+        last = None if position is None else position[kind]
+        async for weight, n in rank(kind, current_row, session, limit, last):
+            answer[kind][n[column.key]] = projection.read(n)
+            last = (weight, n[column.key])
+        if len(answer[kind]) == limit:
+            next_position[kind] = last
+
+    answer["next_cursor"] = encode_cursor(next_position) if next_position else None
+    return answer
+
+
+async def search_stream(current_row: str, limit: int, position: dict | None,
+                        session_maker: async_sessionmaker = async_session_maker):
+    """
+    NDJSON lines, one per hit, written as soon as each kind is ranked; the last line carries next_cursor.
+    Uses its own session: the request one is closed before a streaming body is sent.
+    """
+    next_position = dict()
+
+    async with session_maker() as session:
+        for kind, (projection, column) in KINDS.items():
+            if position is not None and kind not in position:
+                continue
+
+            last, count = None if position is None else position[kind], 0
+            async for weight, n in rank(kind, current_row, session, limit, last):
+                hit = {"kind": kind, "weight": weight, "item": projection.read(n).model_dump(mode="json")}
+                yield json.dumps(hit) + "\n"
+                last, count = (weight, n[column.key]), count + 1
+            if count == limit:
+                next_position[kind] = last
+
+    yield json.dumps({"next_cursor": encode_cursor(next_position) if next_position else None}) + "\n"
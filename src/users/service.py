@@ -1,81 +1,134 @@
+import io
+import uuid
+from typing import Literal, Optional
 from typing_extensions import Any
-from fastapi import Depends, APIRouter, HTTPException
-from fastapi_users.exceptions import UserNotExists
+from fastapi import Depends, APIRouter, HTTPException, Query, Request, Response, UploadFile
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.config import current_user
-from src.users.database import get_session, get_role_by_id, get_user_by_username, get_users_and_companies, get_user_db, \
-    User
-from src.companies.database import get_company_by_id
-from src.users.schemas import ComplaintCreate, ComplaintRead
+from config import SEARCH_LIMIT, SEARCH_MAX_LIMIT, COMPLAINT_INGEST, COMPLAINT_LIMIT, COMPLAINT_MAX_LIMIT
+from src.database.cache import cache
+from src.database.config import current_user, current_superuser, require_permission
+from src.database.db_client import read_session_maker
+from src.users.database import get_session, get_read_only_session, get_profile_body, get_users_and_companies, User, \
+    user_exists, insert_complaint, list_complaints, list_complaint_counts, get_complaint_count, \
+    get_company_complaint_count, invalidate_role_profiles
+from src.users.complaints import complaints, complaint_values
+from src.users.schemas import ComplaintCreate, ComplaintRead, ComplaintAccepted
+from src.users.search import search_stream, decode_cursor
+from src.users.roles import roles
+from src.users.bulk_import import import_file, detect_format
 
 user_router = APIRouter()
 
 @user_router.get("/profile/{username}", name="get_seller_or_owner_profile")
 async def get_seller_or_owner_profile(
     username: str,
-    session: AsyncSession = Depends(get_session),
-) -> dict[str, Any]:
-    try:
-        user_db = await get_user_by_username(username, session)
-        if not user_db:
-            raise HTTPException(status_code=404, detail="Seller or Owner not found")
-        role_db = await get_role_by_id(user_db.role_id, session)
-        if role_db['name'] == "owner":
-            raise HTTPException(status_code=404, detail="Seller or Owner not found")
-        company_db = await get_company_by_id(user_db.company_id, session)
-
-    except UserNotExists:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    return {
-        "username": user_db.username,
-        "email": user_db.email,
-        "first_name": user_db.first_name,
-        "last_name": user_db.last_name,
-        "role": role_db,
-        "company": company_db,
-        "is_verified": user_db.is_verified,
-        "register_at": user_db.register_at,
-    }
+    session: AsyncSession = Depends(get_read_only_session),
+) -> Response:
+    body = await get_profile_body(username, session)
+    if body is None:
+        raise HTTPException(status_code=404, detail="Seller or Owner not found")
+
+    return Response(body, media_type="application/json")
 
 
 @user_router.get("/profile/search/{current_row}", name="search_profiles")
 async def search_profiles(
     current_row: str,
-    session: AsyncSession = Depends(get_session),
+    request: Request,
+    limit: int = Query(default=SEARCH_LIMIT, ge=1, le=SEARCH_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    session: AsyncSession = Depends(get_read_only_session),
 ) -> dict[str, Any]:
-    answer = await get_users_and_companies(current_row, session)
+    if stream:
+        return StreamingResponse(
+            search_stream(current_row, limit, decode_cursor(cursor), read_session_maker(request)),
+            media_type="application/x-ndjson",
+        )
+
+    answer = await get_users_and_companies(current_row, session, limit, cursor)
     if not answer:
         raise HTTPException(status_code=404, detail="Nothing not found")
 
     return answer
 
 
-@user_router.post("/complaint", name="complaint")
+@user_router.post("/complaint", name="complaint", status_code=201)
 async def complaint(
     complaint_data: ComplaintCreate,
-    user_db=Depends(get_user_db),
+    response: Response,
     from_user: User = Depends(current_user),
     session: AsyncSession = Depends(get_session),
-) -> ComplaintRead:
-    addressee = await user_db.get(complaint_data.company_id)
-    if not addressee:
+) -> ComplaintRead | ComplaintAccepted:
+    if not await user_exists(complaint_data.addressee, session):
         raise HTTPException(status_code=404, detail="Nothing not found")
 
-    new_complaint = ComplaintCreate(
-        title=complaint_data.title,
-        content=complaint_data.content,
-        sender=complaint_data.sender,
-        addressee=complaint_data.addressee,
-    )
+    values = complaint_values(complaint_data.title, complaint_data.content, from_user.id, complaint_data.addressee)
+    if COMPLAINT_INGEST == "sync":
+        return await insert_complaint(values, session)
+
+    await complaints.submit(values)
+    response.status_code = 202
+    return ComplaintAccepted(id=values["ingest_id"])
+
+
+@user_router.get("/complaint/against/{addressee}", name="list_complaints")
+async def get_complaints(
+    addressee: uuid.UUID,
+    limit: int = Query(default=COMPLAINT_LIMIT, ge=1, le=COMPLAINT_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    moderator: User = Depends(require_permission("moderate_complaints")),
+    session: AsyncSession = Depends(get_read_only_session),
+) -> dict[str, Any]:
+    answer = await list_complaints(addressee, session, limit, cursor)
+    answer["count"] = await get_complaint_count(addressee, session)
+    return answer
+
+
+@user_router.get("/complaint/counts", name="list_complaint_counts")
+async def get_complaint_counts(
+    limit: int = Query(default=COMPLAINT_LIMIT, ge=1, le=COMPLAINT_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    moderator: User = Depends(require_permission("moderate_complaints")),
+    session: AsyncSession = Depends(get_read_only_session),
+) -> dict[str, Any]:
+    return await list_complaint_counts(session, limit, cursor)
+
+
+@user_router.get("/complaint/counts/company/{company_id}", name="company_complaint_count")
+async def company_complaint_count(
+    company_id: uuid.UUID,
+    moderator: User = Depends(require_permission("moderate_complaints")),
+    session: AsyncSession = Depends(get_read_only_session),
+) -> dict[str, Any]:
+    return {"company_id": company_id, "count": await get_company_complaint_count(company_id, session)}
+
+
+@user_router.get("/complaint/ingestion", name="complaint_ingestion_stats")
+async def complaint_ingestion_stats(superuser: User = Depends(current_superuser)) -> dict[str, Any]:
+    return complaints.stats()
 
-    session.add(new_complaint)
 
-    try:
-        await session.commit()
-        await session.refresh(new_complaint)
-    except:
-        raise HTTPException(status_code=400, detail="Error")
+@user_router.post("/roles/reload", name="reload_roles")
+async def reload_roles(
+    superuser: User = Depends(current_superuser),
+    session: AsyncSession = Depends(get_session),
+) -> dict[str, Any]:
+    changed = await roles.load(session)
+    await cache.publish("roles")  # the other workers reload through cache.watch
+    await invalidate_role_profiles(session, changed)
+
+    return {"roles": [roles.get(role_id) for role_id in roles.table.by_id]}
 
-    return new_complaint
\ No newline at end of file
+
+@user_router.post("/import/{kind}", name="bulk_import")
+async def bulk_import(
+    kind: Literal["users", "companies"],
+    file: UploadFile,
+    superuser: User = Depends(current_superuser),
+    session: AsyncSession = Depends(get_session),
+) -> dict[str, Any]:
+    stream = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+    return await import_file(kind, stream, detect_format(file.filename or ""), session)
@@ -0,0 +1,98 @@
+import math
+from hashlib import blake2b
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import USERNAME_BLOOM_ERROR
+from src.database.cache import cache
+from src.database.db_client import async_session_maker
+from src.users.models import user
+
+
+class UsernameFilter:
+    """
+    Bloom filter of the usernames in the user table: "no" is certain, so a lookup of a name nobody has
+    is answered without Redis or Postgres. Sized for twice the users at build time; names are only added
+    (a rename or delete leaves a false positive behind), and it answers "maybe" until it is built.
+    Other workers learn about a new name through the cache channel, see announce()
+    """
+
+    def __init__(self, error_rate: float = USERNAME_BLOOM_ERROR):
+        self.error_rate = error_rate
+        self.ready = False
+        self.size = 0
+        self.hashes = 0
+        self.bits = bytearray()
+        self.building = None  # names added while a build is reading the table
+        self.counters = {"added": 0, "rejected": 0}
+
+    def positions(self, name: str, size: int, hashes: int):
+        digest = blake2b(name.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % size for i in range(hashes))
+
+    def set(self, bits: bytearray, name: str, size: int, hashes: int) -> None:
+        for position in self.positions(name, size, hashes):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def add(self, name: str) -> None:
+        if self.building is not None:
+            self.building.add(name)
+        if self.ready:
+            self.set(self.bits, name, self.size, self.hashes)
+            self.counters["added"] += 1
+
+    def might_exist(self, name: str) -> bool:
+        if not self.ready:
+            return True
+        for position in self.positions(name, self.size, self.hashes):
+            if not self.bits[position >> 3] & 1 << (position & 7):
+                self.counters["rejected"] += 1
+                return False
+        return True
+
+    async def build(self, session: AsyncSession) -> None:
+        self.building = set()
+        try:
+            count = (await session.execute(select(func.count()).select_from(user))).scalar()
+            capacity = max(2 * count, 1024)
+            size = math.ceil(-capacity * math.log(self.error_rate) / math.log(2) ** 2)
+            hashes = max(1, round(size / capacity * math.log(2)))
+            bits = bytearray((size + 7) // 8)
+
+            result = await session.stream_scalars(select(user.c.username))
+            async for name in result:
+                self.set(bits, name, size, hashes)
+            for name in self.building:
+                self.set(bits, name, size, hashes)
+
+            self.bits, self.size, self.hashes, self.ready = bits, size, hashes, True
+        finally:
+            self.building = None
+
+    async def reload(self) -> None:
+        async with async_session_maker() as session:
+            await self.build(session)
+
+    async def announce(self, *names: str) -> None:
+        """
+        Names that now exist: added here, and published in one message for the other workers' filters
+        """
+        for name in names:
+            self.add(name)
+        if names:
+            await cache.publish(f"username:{','.join(names)}")
+
+    def announced(self, names: str) -> None:
+        """
+        Watcher of the "username:" keys published by another worker; usernames never contain a comma
+        """
+        for name in names.split(","):
+            self.add(name)
+
+    def stats(self) -> dict[str, float]:
+        return {**self.counters, "ready": self.ready, "bits": self.size, "hashes": self.hashes}
+
+
+usernames = UsernameFilter()
@@ -1,92 +1,56 @@
-from math import ceil
-from collections import deque
+import heapq
 
-from src.users.schemas import UserRead, CompanyRead
+from config import SEARCH_LIMIT
 
 
-def similarity_check(current_row: str, users_data, companies_data) -> dict[str, dict | None]:
+def normalize(row: str) -> str:
+    return row.lower().replace(' ', '')
+
+
+def match_masks(current_row: str) -> dict[str, int]:
     """
-    Algorithm for checking differences between a company name or username and the current string
+    Bit i of masks[c] is set when current_row[i] == c
     """
-    users, companies = dict(), dict()
-    users_weights, companies_weights = dict(), dict()
-    users_answer, companies_answer = dict(), dict()
-    users_sorted, companies_sorted = deque(), deque()
+    masks = dict()
+    for i, char in enumerate(current_row):
+        masks[char] = masks.get(char, 0) | (1 << i)
+    return masks
+
 
-    for n in users_data:
-        users[n[2]] = n
-    for key in users:
-        row = key.lower().replace(' ', '')
-        table = [[0 for _ in range(len(row) + 1)] for _ in range(len(current_row) + 1)]
+def lcs_state(masks: dict[str, int], length: int, row: str, state: int | None = None) -> int:
+    """
+    Bit-parallel LCS (Allison-Dix / Hyyro): one integer of `length` bits
+    replaces a row of the dynamic programming table, no table is allocated.
+    Passing the state returned for a prefix of `row` continues from it
+    """
+    full = (1 << length) - 1
+    v = full if state is None else state
+    for char in row:
+        u = v & masks.get(char, 0)
+        v = ((v + u) | (v - u)) & full
+    return v
 
-        for s in range(1, len(current_row) + 1):
-            for c in range(1, len(row) + 1):
-                if row[c - 1] == current_row[s - 1]:
-                    table[s][c] = table[s - 1][c - 1] + 1
-                else:
-                    table[s][c] = max(table[s - 1][c], table[s][c - 1])
-        users_weights[key] = table[-1][-1]
 
-    un = len(users) if len(users) <= 10 else ceil(len(users) * 0.25) # How much need return
-    for i in users_weights:
-        if users_sorted:
-            if users_weights[users_sorted[0]] < users_weights[i]:
-                users_sorted.appendleft(i)
-            else:
-                users_sorted.append(i)
-        else:
-            users_sorted.append(i)
-    for key in list(users_sorted)[0:un]:
-        users_answer[key] = UserRead(
-            id=users[key][0],
-            email=users[key][1],
-            username=users[key][2],
-            first_name=users[key][4],
-            last_name=users[key][5],
-            role_id=users[key][7],
-            company_id=users[key][8],
-            is_verified=users[key][11],
-            register_at=users[key][-1],
-        )
+def lcs_length(masks: dict[str, int], length: int, row: str) -> int:
+    return length - lcs_state(masks, length, row).bit_count()
+
+
+def top_weighted(weights, limit: int = SEARCH_LIMIT, after: tuple | None = None) -> list[tuple[str, int]]:
+    """
+    The `limit` best (name, weight) pairs, heaviest first, ties by name.
+    `after` is a (weight, name) keyset position: only pairs ranked below it are returned
+    """
+    pairs = (pair for pair in weights if pair[1] > 0)
+    if after is not None:
+        position = (-after[0], after[1])
+        pairs = (pair for pair in pairs if (-pair[1], pair[0]) > position)
 
-    if companies_data:
-        for n in companies_data:
-            companies[n[2]] = n
-        for key in companies:
-            row = key.lower().replace(' ', '')
-            table = [[0 for _ in range(len(row) + 1)] for _ in range(len(current_row) + 1)]
+    return heapq.nsmallest(limit, pairs, key=lambda pair: (-pair[1], pair[0]))
 
-            for s in range(1, len(current_row) + 1):
-                for c in range(1, len(row) + 1):
-                    if row[c - 1] == current_row[s - 1]:
-                        table[s][c] = table[s - 1][c - 1] + 1
-                    else:
-                        table[s][c] = max(table[s - 1][c], table[s][c - 1])
-            companies_weights[key] = table[-1][-1]
 
-        cn = len(companies) if len(companies) <= 10 else ceil(len(companies) * 0.25) # How much need return
-        for i in companies_weights:
-            if companies_sorted:
-                if companies_weights[companies_sorted[0]] < companies_weights[i]:
-                    companies_sorted.appendleft(i)
-                else:
-                    companies_sorted.append(i)
-            else:
-                companies_sorted.append(i)
-        for key in list(companies_sorted)[:cn]:
-            companies_answer[key] = CompanyRead(
-            id = companies[key][0],
-            email = companies[key][1],
-            name = companies[key][2],
-            description = companies[key][3],
-            address = companies[key][4],
-            contacts = companies[key][5],
-            register_at = companies[key][7],
-        )
-    else:
-        companies_answer = None
+def top_similar(current_row: str, names, limit: int = SEARCH_LIMIT, after: tuple | None = None) -> list[tuple[str, int]]:
+    current_row = normalize(current_row)
+    masks, length = match_masks(current_row), len(current_row)
 
-    return {
-        "users": users_answer,
-        "companies": companies_answer,
-    }
+    weights = ((name, lcs_length(masks, length, normalize(name))) for name in names)
+    return top_weighted(weights, limit, after)
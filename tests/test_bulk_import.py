@@ -0,0 +1,94 @@
+import io
+
+import pytest
+from fakeredis import FakeAsyncRedis
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+
+from src.companies.models import company_metadata, company
+from src.database.cache import cache
+from src.users.bulk_import import Importer, import_file, read_rows
+from src.users.models import user_metadata, user, role
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def session(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "redis", FakeAsyncRedis(decode_responses=True))
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'import.db'}")
+    async with engine.begin() as connection:
+        await connection.run_sync(company_metadata.create_all)
+        await connection.run_sync(user_metadata.create_all)
+        await connection.execute(role.insert(), [{"id": 1, "name": "beginner", "permissions": {}}])
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        yield session
+    await engine.dispose()
+
+
+USERS = (
+    "username,email,password\n"
+    "seller_a1,a1@x.com,hunter2secret\n"
+    "seller_a2,A1@X.com,hunter2secret\n"   # same email as row 2, case aside
+    "seller_a1,a3@x.com,hunter2secret\n"   # same username as row 2
+    "bad,a4@x.com,hunter2secret\n"         # too short
+    "seller_a5,,hunter2secret\n"           # no email
+)
+
+
+@pytest.mark.anyio
+async def test_import_validates_and_drops_duplicates(session):
+    report = await import_file("users", io.StringIO(USERS), "csv", session, batch_size=2)
+
+    assert report["imported"] == 1
+    assert [error["row"] for error in report["errors"]] == [3, 4, 5, 6]
+    assert report["errors"][0]["errors"] == "email already taken"
+    assert report["errors"][1]["errors"] == "username already taken"
+    assert report["errors"][2]["errors"][0]["loc"] == ["username"]
+    assert "hunter2secret" not in str(report)
+
+    rows = (await session.execute(select(user.c.username, user.c.email, user.c.role_id))).all()
+    assert rows == [("seller_a1", "a1@x.com", 1)]
+
+
+@pytest.mark.anyio
+async def test_import_rejects_rows_already_in_the_table(session):
+    await import_file("users", io.StringIO(USERS), "csv", session)
+    report = await import_file("users", io.StringIO("username,email,password\nseller_a1,new@x.com,pw\n"), "csv", session)
+    assert report["imported"] == 0
+    assert report["errors"] == [{"row": 2, "errors": "username already taken"}]
+
+
+@pytest.mark.anyio
+async def test_failed_batch_does_not_block_its_rows(session, monkeypatch):
+    importer = Importer("users", session, batch_size=10)
+    copy = importer.copy
+
+    async def fail_once(records):
+        monkeypatch.setattr(importer, "copy", copy)
+        raise OSError("connection lost")
+
+    monkeypatch.setattr(importer, "copy", fail_once)
+    rows = "username,email,password\nseller_a1,a1@x.com,pw\n"
+    first = await importer.run(read_rows(io.StringIO(rows), "csv"))
+    assert first["errors"] == [{"row": 2, "errors": "Batch failed: OSError"}]
+
+    importer.errors = []
+    second = await importer.run(read_rows(io.StringIO(rows), "csv"))
+    assert second["imported"] == 1 and second["errors"] == []
+
+
+@pytest.mark.anyio
+async def test_import_companies_from_ndjson(session):
+    lines = (
+        '{"email":"c1@x.com","name":"import_co1","description":"d","address":"a","contacts":{"p":1}}\n'
+        "not json\n"
+        '{"email":"c2@x.com","name":"import_co1","description":"d","address":"a","contacts":{}}\n'
+    )
+    report = await import_file("companies", io.StringIO(lines), "ndjson", session)
+    assert report["imported"] == 1
+    assert report["errors"] == [{"row": 2, "errors": "Malformed row"}, {"row": 3, "errors": "name already taken"}]
+    assert (await session.execute(select(company.c.name, company.c.contacts))).all() == [("import_co1", {"p": 1})]
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import time
+import uuid
+from datetime import date
+
+import pytest
+from fakeredis import FakeAsyncRedis
+
+from src.database.cache import TwoTierCache, MISSING
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def cache():
+    return TwoTierCache(FakeAsyncRedis(decode_responses=True), maxsize=100, local_ttl=60, refresh_beta=0)
+
+
+def other_worker(cache: TwoTierCache) -> TwoTierCache:
+    return TwoTierCache(cache.redis, maxsize=100, local_ttl=60, refresh_beta=0)
+
+
+class Loader:
+    def __init__(self, value, delay: float = 0.05):
+        self.value = value
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if isinstance(self.value, Exception):
+            raise self.value
+        return self.value
+
+
+@pytest.mark.anyio
+async def test_concurrent_misses_share_one_load(cache):
+    load = Loader({"id": 1})
+    results = await asyncio.gather(*(cache.fetch("company:1", load, 60) for _ in range(20)))
+    assert results == [{"id": 1}] * 20
+    assert load.calls == 1
+    assert cache.counters["coalesced"] == 19
+
+
+@pytest.mark.anyio
+async def test_waiters_get_the_form_they_asked_for(cache):
+    load = Loader(b'{"id":1}')
+    raw, parsed = await asyncio.gather(
+        cache.fetch("company:1", load, 60, raw=True), cache.fetch("company:1", load, 60),
+    )
+    assert (raw, parsed) == (b'{"id":1}', {"id": 1})
+    assert load.calls == 1
+
+
+@pytest.mark.anyio
+async def test_failed_load_reaches_every_waiter_and_is_retried(cache):
+    load = Loader(RuntimeError("database down"))
+    results = await asyncio.gather(*(cache.fetch("company:1", load, 60) for _ in range(5)), return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert load.calls == 1
+    assert not cache.flights
+
+    load.value = {"id": 1}
+    assert await cache.fetch("company:1", load, 60) == {"id": 1}
+    assert load.calls == 2
+
+
+@pytest.mark.anyio
+async def test_other_workers_wait_for_the_lock_holder(cache):
+    other = other_worker(cache)
+    load = Loader({"id": 1}, delay=0.1)
+    results = await asyncio.gather(cache.fetch("company:1", load, 60), other.fetch("company:1", load, 60))
+    assert results == [{"id": 1}, {"id": 1}]
+    assert load.calls == 1
+    assert cache.counters["lock_waits"] + other.counters["lock_waits"] == 1
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("value", [None, RuntimeError("database down")])
+async def test_waiters_stop_waiting_when_the_lock_is_released_empty(cache, value):
+    other = other_worker(cache)
+    holder, waiter = Loader(value, delay=0.05), Loader(None, delay=0)
+
+    async def wait() -> tuple:
+        await asyncio.sleep(0.01)  # the holder takes the lock first
+        started = time.monotonic()
+        result = await other.fetch("company:1", waiter, 60)
+        return result, time.monotonic() - started
+
+    _, (result, seconds) = await asyncio.gather(cache.fetch("company:1", holder, 60), wait(), return_exceptions=True)
+    assert result is None
+    assert waiter.calls == 1
+    assert seconds < cache.lock_ms / 1000 / 2
+
+
+@pytest.mark.anyio
+async def test_missing_rows_are_cached_for_negative_ttl(cache):
+    load = Loader(None, delay=0)
+    assert await cache.fetch("profile:nobody", load, 60, negative_ttl=30) is None
+    assert await cache.fetch("profile:nobody", load, 60, negative_ttl=30) is None
+    assert load.calls == 1
+    assert cache.counters["negative_hits"] == 1
+    assert await cache.redis.get("profile:nobody") == MISSING
+    assert 0 < await cache.redis.ttl("profile:nobody") <= 30
+
+    cache.local.clear()  # the Redis copy answers too
+    assert await cache.fetch("profile:nobody", load, 60, raw=True, negative_ttl=30) is None
+    assert load.calls == 1
+
+
+@pytest.mark.anyio
+async def test_missing_rows_are_not_cached_without_negative_ttl(cache):
+    load = Loader(None, delay=0)
+    assert await cache.fetch("profile:nobody", load, 60) is None
+    assert await cache.fetch("profile:nobody", load, 60) is None
+    assert load.calls == 2
+
+
+@pytest.mark.anyio
+async def test_invalidate_drops_a_cached_missing_row(cache):
+    load = Loader(None, delay=0)
+    assert await cache.fetch_versioned("profile:newbie", load, 60, raw=True, negative_ttl=30) is None
+
+    load.value = b'{"username":"newbie"}'
+    await cache.invalidate("profile:newbie")
+    assert await cache.fetch_versioned("profile:newbie", load, 60, raw=True, negative_ttl=30) == load.value
+    assert load.calls == 2
+
+
+@pytest.mark.anyio
+async def test_set_keeps_redis_and_local_copies_alike(cache):
+    value = {"id": uuid.UUID(int=1), "at": date(2024, 1, 2), "n": 1}
+    await cache.set("company:1", value, 60)
+    stored = json.loads(await cache.redis.get("company:1"))
+    assert stored == {"id": str(uuid.UUID(int=1)), "at": "2024-01-02", "n": 1}
+    assert cache.get_local("company:1") == stored
+
+
+@pytest.mark.anyio
+async def test_listener_survives_bad_messages_and_watchers(cache, caplog):
+    other = other_worker(cache)
+    seen = []
+
+    def broken(suffix):
+        raise ValueError(suffix)
+
+    other.watch_prefix("search:", broken)
+    other.watch_prefix("search:users:", seen.append)
+    other.local["company:1"] = (time.monotonic() + 60, {"id": 1}, None)
+    listener = asyncio.create_task(other.listen())
+    await asyncio.wait_for(other.subscribed.wait(), 1)
+
+    await cache.redis.publish(cache.channel, "no-space")
+    await cache.publish("search:users:abc")
+    await cache.publish("company:1")
+    for _ in range(100):
+        if "company:1" not in other.local:
+            break
+        await asyncio.sleep(0.01)
+    assert not listener.done()  # still listening
+    listener.cancel()
+
+    assert "company:1" not in other.local
+    assert seen == ["abc"]
+    assert "bad cache invalidation 'no-space'" in caplog.text
+    assert "cache watcher for 'search:' failed" in caplog.text
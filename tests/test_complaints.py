@@ -0,0 +1,208 @@
+import json
+import uuid
+from datetime import datetime
+
+import pytest
+from fakeredis import FakeAsyncRedis
+from fastapi import HTTPException
+from sqlalchemy import event, select, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from src.companies.models import company_metadata
+from src.database.cache import json_default
+from src.users.complaints import ComplaintBuffer, complaint_values
+from src.users.database import insert_complaints, list_complaints, list_complaint_counts, get_complaint_count
+from src.users.models import user_metadata, user, complaint, complaint_count
+from src.users.search import encode_cursor
+
+SENDER, ADDRESSEE = uuid.uuid4(), uuid.uuid4()
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def session_maker(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'complaints.db'}")
+    event.listen(engine.sync_engine, "connect", lambda connection, _: connection.execute("PRAGMA foreign_keys=ON"))
+    async with engine.begin() as connection:
+        await connection.run_sync(company_metadata.create_all)
+        await connection.run_sync(user_metadata.create_all)
+        await connection.execute(user.insert(), [
+            {"id": user_id, "email": f"{name}@x.com", "username": name, "hashed_password": "x",
+             "register_at": datetime.now()}
+            for user_id, name in [(SENDER, "sender"), (ADDRESSEE, "addressee")]
+        ])
+    yield async_sessionmaker(engine, expire_on_commit=False)
+    await engine.dispose()
+
+
+def make_buffer(mode: str, session_maker, batch_size: int = 3) -> ComplaintBuffer:
+    return ComplaintBuffer(mode, batch_size, 0.01, 10, 1000, FakeAsyncRedis(decode_responses=True), session_maker)
+
+
+def complaints(count: int, addressee=ADDRESSEE) -> list[dict]:
+    return [complaint_values(f"title {n}", "content", SENDER, addressee) for n in range(count)]
+
+
+async def stored(session_maker) -> tuple[int, int]:
+    async with session_maker() as session:
+        rows = (await session.execute(select(func.count()).select_from(complaint))).scalar()
+        counted = (await session.execute(select(complaint_count.c.count))).scalar()
+    return rows, counted or 0
+
+
+@pytest.mark.anyio
+async def test_buffer_flushes_in_batches(session_maker):
+    buffer = make_buffer("buffer", session_maker)
+    for values in complaints(7):
+        await buffer.submit(values)
+    assert buffer.ready.is_set()
+
+    await buffer.flush()
+    assert buffer.pending == []
+    assert buffer.counters["batches"] == 3
+    assert await stored(session_maker) == (7, 7)
+
+
+@pytest.mark.anyio
+async def test_redelivered_complaints_are_stored_once(session_maker):
+    buffer = make_buffer("buffer", session_maker)
+    values = complaints(2)
+    for row in values + values:
+        await buffer.submit(row)
+    await buffer.flush()
+    assert await stored(session_maker) == (2, 2)
+
+
+@pytest.mark.anyio
+async def test_rows_breaking_a_constraint_are_dropped_alone(session_maker):
+    buffer = make_buffer("buffer", session_maker)
+    for values in complaints(1) + complaints(1, addressee=uuid.uuid4()) + complaints(1):
+        await buffer.submit(values)
+    await buffer.flush()
+    assert (buffer.counters["stored"], buffer.counters["dropped"]) == (2, 1)
+    assert await stored(session_maker) == (2, 2)
+
+
+@pytest.mark.anyio
+async def test_failed_batch_stays_queued(session_maker, monkeypatch):
+    buffer = make_buffer("buffer", session_maker)
+    for values in complaints(2):
+        await buffer.submit(values)
+    write = buffer.write
+
+    async def fail(rows):
+        raise OperationalError("INSERT", {}, Exception("database is down"))
+
+    monkeypatch.setattr(buffer, "write", fail)
+    with pytest.raises(OperationalError):
+        await buffer.flush()
+    assert len(buffer.pending) == 2
+
+    monkeypatch.setattr(buffer, "write", write)
+    await buffer.close()
+    assert await stored(session_maker) == (2, 2)
+
+
+@pytest.mark.anyio
+async def test_stream_moves_malformed_entries_to_dead_letters(session_maker):
+    buffer = make_buffer("stream", session_maker)
+    await buffer.create_group()
+    good = complaints(2)
+    await buffer.submit(good[0])
+    await buffer.redis.xadd(buffer.stream, {"complaint": "not json"})
+    await buffer.redis.xadd(buffer.stream, {"other": "field"})
+    await buffer.submit(good[1])
+
+    await buffer.drain()
+    assert await stored(session_maker) == (2, 2)
+    assert buffer.counters["dead_letters"] == 2
+    assert await buffer.redis.xlen(buffer.stream) == 0
+    dead = [fields for _, fields in await buffer.redis.xrange(buffer.dead_letters)]
+    assert [fields.get("complaint") for fields in dead] == ["not json", None]
+    assert all("entry_id" in fields and "error" in fields for fields in dead)
+
+
+@pytest.mark.anyio
+async def test_stream_entries_are_acknowledged_only_after_commit(session_maker, monkeypatch):
+    buffer = make_buffer("stream", session_maker)
+    await buffer.create_group()
+    for values in complaints(2):
+        await buffer.redis.xadd(buffer.stream, {"complaint": json.dumps(values, default=json_default)})
+    write = buffer.write
+
+    async def fail(rows):
+        raise OSError("connection lost")
+
+    monkeypatch.setattr(buffer, "write", fail)
+    with pytest.raises(OSError):
+        await buffer.consume(">")
+    assert (await buffer.redis.xpending(buffer.stream, buffer.group))["pending"] == 2
+
+    monkeypatch.setattr(buffer, "write", write)
+    assert await buffer.consume("0") == 2  # re-read from this consumer's pending entries
+    assert (await buffer.redis.xpending(buffer.stream, buffer.group))["pending"] == 0
+    assert await stored(session_maker) == (2, 2)
+
+
+async def insert_at(session_maker, *times: datetime, addressee=ADDRESSEE) -> None:
+    async with session_maker() as session:
+        await insert_complaints([
+            {**values, "register_at": at} for values, at in zip(complaints(len(times), addressee), times)
+        ], session)
+
+
+@pytest.mark.anyio
+async def test_counter_upsert_adds_to_existing_counts(session_maker):
+    await insert_at(session_maker, datetime(2024, 1, 3), datetime(2024, 1, 1), addressee=SENDER)
+    await insert_at(session_maker, datetime(2024, 1, 2), addressee=SENDER)
+    async with session_maker() as session:
+        assert await get_complaint_count(SENDER, session) == 3
+        assert await get_complaint_count(ADDRESSEE, session) == 0
+        last_at = (await session.execute(select(complaint_count.c.last_at))).scalar()
+    assert last_at == datetime(2024, 1, 3)  # not moved back by an older batch
+
+
+@pytest.mark.anyio
+async def test_complaint_pages_follow_the_keyset(session_maker):
+    same = datetime(2024, 1, 1)
+    await insert_at(session_maker, same, same, same, datetime(2024, 1, 2), datetime(2023, 12, 31))
+    pages, cursor = [], None
+    async with session_maker() as session:
+        while True:
+            page = await list_complaints(ADDRESSEE, session, 2, cursor)
+            pages.extend((item.register_at, item.id) for item in page["items"])
+            if (cursor := page["next_cursor"]) is None:
+                break
+    assert pages == sorted(pages, reverse=True)
+    assert len(set(pages)) == 5
+
+
+@pytest.mark.anyio
+async def test_count_pages_break_ties_by_addressee(session_maker):
+    await insert_at(session_maker, datetime(2024, 1, 1), datetime(2024, 1, 2))
+    await insert_at(session_maker, datetime(2024, 1, 1), datetime(2024, 1, 2), addressee=SENDER)
+    async with session_maker() as session:
+        first = await list_complaint_counts(session, 1)
+        second = await list_complaint_counts(session, 1, first["next_cursor"])
+        third = await list_complaint_counts(session, 1, second["next_cursor"])
+    addressees = [page["items"][0]["addressee"] for page in (first, second)]
+    assert addressees == sorted([SENDER, ADDRESSEE], key=str)
+    assert third == {"items": [], "next_cursor": None}
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("cursor", [
+    "not base64",
+    encode_cursor({"register_at": "yesterday", "id": 1}),
+    encode_cursor({"register_at": "2024-01-01T00:00:00"}),
+])
+async def test_malformed_complaint_cursors_are_rejected(session_maker, cursor):
+    async with session_maker() as session:
+        with pytest.raises(HTTPException) as error:
+            await list_complaints(ADDRESSEE, session, 2, cursor)
+    assert error.value.status_code == 400
@@ -0,0 +1,47 @@
+import pytest
+
+from src.companies.models import company_metadata
+from src.users.models import user_metadata
+from src.users.projections import Projection, USER_READ, COMPANY_READ
+from src.users.schemas import UserRead
+from src.companies.schemas import CompanyRead
+
+
+@pytest.mark.parametrize("projection, metadata, table", [
+    (USER_READ, user_metadata, "user"),
+    (COMPANY_READ, company_metadata, "company"),
+])
+def test_projection_columns_exist_in_table(projection, metadata, table):
+    columns = metadata.tables[table].c
+    for column in projection.columns:
+        assert column.key in columns
+        assert columns[column.key].type.__class__ is column.type.__class__
+
+
+@pytest.mark.parametrize("projection, model", [(USER_READ, UserRead), (COMPANY_READ, CompanyRead)])
+def test_projection_covers_read_model(projection, model):
+    assert set(projection.names) <= set(model.model_fields)
+    required = {name for name, field in model.model_fields.items() if field.is_required()}
+    assert required <= set(projection.names)
+
+
+def test_projection_skips_unread_columns():
+    assert "hashed_password" not in USER_READ.names
+    assert "balance" not in USER_READ.names
+
+
+def test_projection_rejects_foreign_and_unknown_columns():
+    users, companies = user_metadata.tables["user"], company_metadata.tables["company"]
+    with pytest.raises(ValueError, match=r"foreign \['name'\]"):
+        Projection(UserRead, users, *USER_READ.columns, companies.c.name)
+    with pytest.raises(ValueError, match=r"unknown \['balance'\]"):
+        Projection(UserRead, users, *USER_READ.columns, users.c.balance)
+    with pytest.raises(ValueError, match=r"missing \[.*'email'"):
+        Projection(UserRead, users, users.c.id)
+
+
+def test_pick_maps_by_name():
+    row = {name: index for index, name in enumerate(reversed(COMPANY_READ.names))}
+    row["is_active"] = True
+    assert COMPANY_READ.pick(row) == {name: row[name] for name in COMPANY_READ.names}
+
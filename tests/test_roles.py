@@ -0,0 +1,100 @@
+import uuid
+from datetime import datetime
+
+import pytest
+from fakeredis import FakeAsyncRedis
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+
+from src.companies.models import company_metadata
+from src.database.cache import cache
+from src.users.database import invalidate_role_profiles
+from src.users.models import user_metadata, user, role
+from src.users.roles import Roles, RoleTable
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def session(monkeypatch):
+    monkeypatch.setattr(cache, "redis", FakeAsyncRedis(decode_responses=True))
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as connection:
+        await connection.run_sync(company_metadata.create_all)
+        await connection.run_sync(user_metadata.create_all)
+        await connection.execute(role.insert(), [
+            {"id": 1, "name": "beginner", "permissions": ["file_complaints"]},
+            {"id": 2, "name": "moderator", "permissions": ["file_complaints", "moderate_complaints"]},
+        ])
+        await connection.execute(user.insert(), [
+            {"id": uuid.uuid4(), "email": f"{name}@x.com", "username": name, "hashed_password": "x",
+             "role_id": role_id, "register_at": datetime.now()}
+            for name, role_id in [("seller_a", 1), ("seller_b", 1), ("mod_c", 2)]
+        ])
+    async with AsyncSession(engine) as session:
+        yield session
+    await engine.dispose()
+
+
+@pytest.mark.anyio
+async def test_reload_reports_changed_roles(session):
+    roles = Roles()
+    assert await roles.load(session) == {1, 2}
+    assert await roles.load(session) == set()
+
+    await session.execute(update(role).where(role.c.id == 2).values(permissions=["moderate_complaints"]))
+    await session.execute(role.insert().values(id=3, name="owner", permissions=[]))
+    assert await roles.load(session) == {2, 3}
+    assert roles.allows(2, "moderate_complaints") and not roles.allows(2, "file_complaints")
+
+
+@pytest.mark.anyio
+async def test_role_change_invalidates_its_profiles(session):
+    await invalidate_role_profiles(session, {1})
+    assert await cache.redis.get("profile:seller_a:version") == "1"
+    assert await cache.redis.get("profile:seller_b:version") == "1"
+    assert await cache.redis.get("profile:mod_c:version") is None
+
+
+ROWS = [
+    (1, "beginner", ["file_complaints"]),
+    (2, "moderator", {"file_complaints": True, "moderate_complaints": True, "ban": False}),
+    (3, "owner", None),
+]
+
+
+def test_every_granted_permission_gets_its_own_bit():
+    table = RoleTable(ROWS)
+    assert dict(table.bits) == {"file_complaints": 1, "moderate_complaints": 2}  # "ban" is never granted
+    assert [table.by_id[role_id].mask for role_id in (1, 2, 3)] == [1, 3, 0]
+
+
+def test_allows_needs_every_permission():
+    table = RoleTable(ROWS)
+    assert table.allows(2, "file_complaints", "moderate_complaints")
+    assert table.allows(1, "file_complaints")
+    assert not table.allows(1, "file_complaints", "moderate_complaints")
+    assert not table.allows(3, "file_complaints")
+    assert table.allows(3)  # nothing required
+
+
+def test_unknown_roles_and_permissions_are_denied():
+    table = RoleTable(ROWS)
+    assert table.mask("ban") is None
+    assert not table.allows(2, "ban")
+    assert not table.allows(99, "file_complaints")
+    assert not RoleTable().allows(1)
+
+
+def test_snapshot_does_not_share_permissions():
+    permissions = ["file_complaints"]
+    table = RoleTable([(1, "beginner", permissions)])
+    permissions.append("moderate_complaints")
+    roles = Roles()
+    roles.table = table
+    roles.get(1)["permissions"].append("ban")
+    assert roles.get(1)["permissions"] == ["file_complaints"]
+    assert not roles.allows(1, "moderate_complaints")
@@ -0,0 +1,158 @@
+import random
+import uuid
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+
+from src.companies.models import company_metadata, company
+from src.users.models import user_metadata, user
+from src.users.search import SearchIndex, SearchCache, decode_cursor, encode_cursor
+from src.users.utils import match_masks, lcs_state, top_similar
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def random_strings(count: int, alphabet: str, longest: int = 12, seed: int = 0) -> list[str]:
+    rnd = random.Random(seed)
+    return ["".join(rnd.choices(alphabet, k=rnd.randint(1, longest))) for _ in range(count)]
+
+
+def make_index(names: list[str]) -> SearchIndex:
+    index = SearchIndex()
+    for name in names:
+        index.add("users", {"id": uuid.uuid4(), "username": name})
+    return index
+
+
+def test_only_rows_sharing_an_ngram_are_scored():
+    names = random_strings(2000, "bdfghjklnopqrstuvwxyz_") + ["acme", "acme_store", "my_cme", "acxme_store"]
+    index = make_index(names)
+    states = index.states("users", "acme")
+    assert set(states) == {"acme", "acme_store", "my_cme"}  # "acm" or "cme"; not "acxme_store"
+    assert len(states) < len(names) / 100
+
+
+def test_candidates_rank_like_a_scan_of_the_candidates():
+    names = list(dict.fromkeys(random_strings(1000, "abcdemorx_", seed=4)))
+    index = make_index(names)
+    for query in ["acme", "storeacme", "xq"] + random_strings(30, "abcdemorx", 8, seed=5):
+        candidates = index.states("users", query)
+        assert index.top("users", query, 10) == top_similar(query, candidates, 10)
+
+
+def test_index_follows_renames_and_removals():
+    index = make_index([])
+    row_id = uuid.uuid4()
+    index.add("users", {"id": row_id, "username": "acme_old"})
+    assert [name for name, _ in index.top("users", "acme", 5)] == ["acme_old"]
+    index.add("users", {"id": row_id, "username": "acme_new"})
+    assert [name for name, _ in index.top("users", "acme", 5)] == ["acme_new"]
+    index.remove("users", row_id)
+    assert index.top("users", "acme", 5) == []
+
+
+@pytest.mark.anyio
+async def test_rebuild_keeps_serving_the_current_index():
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as connection:
+        await connection.run_sync(company_metadata.create_all)
+        await connection.run_sync(user_metadata.create_all)
+        await connection.execute(company.insert(), [{
+            "id": uuid.uuid4(), "email": "c@x.com", "name": "acme_co", "description": "", "address": "",
+            "contacts": {}, "register_at": datetime.now(),
+        }])
+        await connection.execute(user.insert(), [{
+            "id": uuid.uuid4(), "email": "u@x.com", "username": "acme_user", "hashed_password": "x",
+            "register_at": datetime.now(),
+        }])
+
+    index = make_index(["old_name"])
+    index.ready = True
+    seen_during_build = []
+
+    class WatchedSession(AsyncSession):
+        async def execute(self, *args, **kwargs):
+            seen_during_build.append((index.ready, set(index.rows["users"])))
+            return await super().execute(*args, **kwargs)
+
+    async with WatchedSession(engine) as session:
+        await index.build(session)
+    await engine.dispose()
+
+    assert seen_during_build == [(True, {"old_name"})] * 2
+    assert index.ready
+    assert set(index.rows["users"]) == {"acme_user"}
+    assert set(index.rows["companies"]) == {"acme_co"}
+
+
+def test_keyset_pages_cover_the_ranking_once():
+    names = list(dict.fromkeys(random_strings(500, "abcdemorx_", seed=6)))
+    ranked = top_similar("acme", names, len(names))
+    pages, after = [], None
+    while page := top_similar("acme", names, 7, after):
+        pages.extend(page)
+        after = decode_cursor(encode_cursor({"users": (page[-1][1], page[-1][0])}))["users"]
+    assert pages == ranked
+
+
+@pytest.mark.parametrize("position", [
+    {"users": ["3", "name"]},
+    {"users": [3, 5]},
+    {"users": [True, "name"]},
+    {"users": [None, "name"]},
+    {"users": [3]},
+])
+def test_decode_cursor_rejects_malformed_positions(position):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(encode_cursor(position))
+    assert error.value.status_code == 400
+
+
+def test_decode_cursor_round_trip():
+    position = {"users": [4, "acme"], "companies": [2.5, "shop"], "unknown": [1, "x"]}
+    assert decode_cursor(encode_cursor(position)) == {"users": (4, "acme"), "companies": (2.5, "shop")}
+    assert decode_cursor(None) is None
+    with pytest.raises(HTTPException):
+        decode_cursor("not base64 json")
+
+
+def test_lcs_state_continues_from_a_prefix():
+    for name in random_strings(40, "abcde_", seed=1):
+        masks = match_masks(name)
+        for query in random_strings(20, "abcde_", seed=2):
+            for end in range(len(query) + 1):
+                prefix_state = lcs_state(masks, len(name), query[:end])
+                assert lcs_state(masks, len(name), query[end:], prefix_state) == lcs_state(masks, len(name), query)
+
+
+def test_prefix_reuse_gives_fresh_states():
+    names = list(dict.fromkeys(random_strings(300, "abcdemn", seed=3)))
+    reused, fresh = make_index(names), make_index(names)
+    for query in ("a", "ab", "abc", "abcd", "abcde", "abcdem", "mnab", "mnabc"):
+        states = reused.states("users", query)
+        fresh.cache.clear()
+        assert states == fresh.states("users", query)
+
+
+def test_prefix_reuse_skips_shorter_prefixes():
+    index = make_index(["abcdef", "xyz"])
+    index.states("users", "abc")
+    assert index.reusable_prefix("users", "abcd") == ("abc", index.cache.get("users", "abc"))
+    assert index.reusable_prefix("users", "ab") == (None, None)
+
+
+def test_search_cache_is_bounded_by_cached_states():
+    cache = SearchCache(maxsize=10, ttl=60, max_states=5)
+    cache.put("users", "big", {str(n): n for n in range(6)})
+    assert cache.get("users", "big") is None  # more candidates than the whole cache may hold
+
+    cache.put("users", "a", {"x": 1, "y": 2})
+    cache.put("users", "b", {"x": 1, "y": 2})
+    cache.put("users", "c", {"x": 1, "y": 2})
+    assert cache.get("users", "a") is None
+    assert cache.states_count() == 4
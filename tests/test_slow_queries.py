@@ -0,0 +1,31 @@
+import pytest
+
+from src.database.slow_queries import normalize, parameter_shapes
+
+
+@pytest.mark.parametrize("statement, expected", [
+    ("SELECT *\n  FROM  user WHERE id = 42", "SELECT * FROM user WHERE id = ?"),
+    ("SELECT * FROM t WHERE name = 'O''Brien 12' AND x > 1.5", "SELECT * FROM t WHERE name = ? AND x > ?"),
+    ("SELECT * FROM t WHERE id IN ($1, $2, $3)", "SELECT * FROM t WHERE id IN (...)"),
+    ("SELECT * FROM t WHERE id IN (?, ?)", "SELECT * FROM t WHERE id IN (...)"),
+    ("SELECT * FROM t WHERE id IN (%(id_1)s, %(id_2)s)", "SELECT * FROM t WHERE id IN (...)"),
+    ("INSERT INTO t (a, b) VALUES (?, ?), (?, ?), (?, ?)", "INSERT INTO t (a, b) VALUES (...), ..."),
+    ("SELECT col1, t2.x FROM t2 WHERE y = $12", "SELECT col1, t2.x FROM t2 WHERE y = $12"),
+])
+def test_normalize(statement, expected):
+    assert normalize(statement) == expected
+
+
+def test_statements_of_one_shape_normalize_alike():
+    assert normalize("SELECT * FROM t WHERE id IN (?, ?)") == normalize("SELECT * FROM t WHERE id IN (?, ?, ?, ?)")
+
+
+def test_parameter_shapes_hide_values():
+    assert parameter_shapes(("secret", 3, None, b"xy"), False) == ["str[6]", "int", "NoneType", "bytes[2]"]
+    assert parameter_shapes({"password": "hunter2", "ids": [1, 2]}, False) == {"password": "str[7]", "ids": "list[2]"}
+    assert parameter_shapes(None, False) == []
+
+
+def test_parameter_shapes_of_executemany():
+    assert parameter_shapes([("a", 1), ("bc", 2)], True) == "2 rows of ['str[1]', 'int']"
+    assert parameter_shapes(iter([]), True) == "0 rows"
@@ -0,0 +1,36 @@
+from src.users.usernames import UsernameFilter
+
+
+def built_filter(names: list[str]) -> UsernameFilter:
+    usernames = UsernameFilter(error_rate=0.01)
+    usernames.size, usernames.hashes = 9816, 7  # what build() picks for up to 512 users
+    usernames.bits = bytearray((usernames.size + 7) // 8)
+    usernames.ready = True
+    for name in names:
+        usernames.add(name)
+    return usernames
+
+
+def test_filter_answers_maybe_until_built():
+    assert UsernameFilter().might_exist("anyone")
+
+
+def test_filter_never_rejects_an_added_name():
+    names = [f"user_{n}" for n in range(500)]
+    usernames = built_filter(names)
+    assert all(usernames.might_exist(name) for name in names)
+    false_positives = sum(usernames.might_exist(f"nobody_{n}") for n in range(2000))
+    assert false_positives < 2000 * 0.03
+
+
+def test_announced_names_are_added():
+    usernames = built_filter([])
+    usernames.announced("seller_a1,seller_a2")
+    assert usernames.might_exist("seller_a1") and usernames.might_exist("seller_a2")
+
+
+def test_names_added_during_a_build_are_kept():
+    usernames = built_filter([])
+    usernames.building = set()
+    usernames.add("late_name")
+    assert usernames.building == {"late_name"}
@@ -0,0 +1,46 @@
+import random
+
+from src.users.utils import match_masks, lcs_length, top_weighted, top_similar
+
+
+def lcs_table(a: str, b: str) -> int:
+    """
+    Reference: the dynamic programming table the bit-parallel engine replaced
+    """
+    table = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            if a[i - 1] == b[j - 1]:
+                table[i][j] = table[i - 1][j - 1] + 1
+            else:
+                table[i][j] = max(table[i - 1][j], table[i][j - 1])
+    return table[-1][-1]
+
+
+def random_strings(count: int, alphabet: str = "abcde_", longest: int = 12, seed: int = 0) -> list[str]:
+    rnd = random.Random(seed)
+    return ["".join(rnd.choices(alphabet, k=rnd.randint(0, longest))) for _ in range(count)]
+
+
+def test_lcs_matches_dynamic_programming():
+    strings = random_strings(60)
+    for name in strings:
+        masks = match_masks(name)
+        for query in strings:
+            assert lcs_length(masks, len(name), query) == lcs_table(name, query)
+
+
+def test_lcs_of_long_names():
+    # longer than a machine word: the state is a Python int of any size
+    name, query = "ab" * 80, "ba" * 70
+    assert lcs_length(match_masks(name), len(name), query) == lcs_table(name, query)
+
+
+def test_top_weighted_orders_by_weight_then_name():
+    weights = [("b", 2), ("a", 2), ("c", 3), ("d", 0), ("e", 1)]
+    assert top_weighted(weights, 3) == [("c", 3), ("a", 2), ("b", 2)]
+    assert top_weighted(weights, 10) == [("c", 3), ("a", 2), ("b", 2), ("e", 1)]  # weight 0 is no match
+
+
+def test_top_similar_normalizes_names():
+    assert top_similar("Ac Me", ["a c m e", "xyz", "acorn"], 5) == [("a c m e", 4), ("acorn", 2)]